@@ -14,9 +14,13 @@ from datetime import datetime
 from urllib.parse import unquote
 
 from stix2arango.version import __version__, __author__
-from stix2arango.request import Request
-from stix2arango.feed import vaccum, Feed
+from stix2arango.request import Request, pattern_cache_info
+from stix2arango.feed import vaccum, Feed, bump_catalog_version, \
+    get_catalog_version
 from stix2arango.storage import snapshot, snapshot_restore
+from stix2arango.scheduler import VaccumScheduler
+from stix2arango.cache import get_feed_catalog
+from stix2arango.garbage import collect_garbage
 from stix2arango.utils import ArangoUser
 from stix2arango.postgresql import PostgresOptimizer
 
@@ -25,6 +29,8 @@ db_conn = None
 arangoURL = None
 login_manager = LoginManager()
 authenticated_users = {}
+vaccum_scheduler = None
+request_timeout = None
 
 
 """
@@ -62,21 +68,42 @@ def request_for_stix():
         depth = 3
     if not pattern:
         return {'error': 'pattern is required'}
-    r = Request(db_conn, date)
+    r = Request(db_conn, date, timeout=request_timeout)
+    results = r.request(
+        unquote(pattern), 
+        tags, 
+        max_depth=depth,
+        create_index=not(no_index_creation)
+        )
     return {
-        'results': r.request(
-            unquote(pattern), 
-            tags, 
-            max_depth=depth,
-            create_index=not(no_index_creation)
-            )
+        'results': results,
+        'timed_out_feeds': r.timed_out_feeds,
+        'failed_feeds': r.failed_feeds
         }
 
 @app.route('/vaccum', methods=['GET'])
 @login_required
 def vaccum_database():
-    vaccum(db_conn)
-    return {'results': 'ok'}
+    started = vaccum_scheduler.trigger()
+    return {'results': {
+        'started': started,
+        'status': vaccum_scheduler.status()
+    }}
+
+
+@app.route('/vaccum/status', methods=['GET'])
+@login_required
+def vaccum_status():
+    return {'results': vaccum_scheduler.status()}
+
+
+@app.route('/stats', methods=['GET'])
+@login_required
+def stats():
+    return {'results': {
+        'pattern_cache': pattern_cache_info(),
+        'feed_catalog': get_feed_catalog(db_conn).info()
+    }}
 
 
 @app.route('/login', methods=['POST'])
@@ -104,6 +131,15 @@ def load_user(user_id):
 
 def launch_web_server(args):
     global login_manager
+    global vaccum_scheduler
+    global request_timeout
+    request_timeout = args.request_timeout
+    vaccum_scheduler = VaccumScheduler(
+        db_conn,
+        interval=args.vaccum_interval,
+        drops_per_second=args.vaccum_drops_per_second
+    )
+    vaccum_scheduler.start()
     login_manager.init_app(app)
     app.config['SECRET_KEY'] = os.urandom(30).hex()
     if args.ssl_cert and args.ssl_key:
@@ -148,7 +184,7 @@ if __name__ == '__main__':
     parser.add_argument(
         '--action',
         default='web_server',
-        help='can be web_server, vaccum, snapshot or restore'
+        help='can be web_server, vaccum, gc, snapshot or restore'
     )
     parser.add_argument(
         '--snapshot_dir',
@@ -169,6 +205,32 @@ if __name__ == '__main__':
         default=622,
         help='Port for the web server'
     )
+    parser.add_argument(
+        '--vaccum_interval',
+        default=None,
+        type=float,
+        help='Seconds between two vaccums run by web_server, ' +
+            'vaccum only runs on /vaccum calls by default'
+    )
+    parser.add_argument(
+        '--vaccum_drops_per_second',
+        default=None,
+        type=float,
+        help='Maximum number of collections dropped per second by vaccum'
+    )
+    parser.add_argument(
+        '--gc_apply',
+        action='store_true',
+        help='Drop the orphan collections and tables found by gc, ' +
+            'gc only reports them by default'
+    )
+    parser.add_argument(
+        '--request_timeout',
+        default=None,
+        type=float,
+        help='Seconds given to the feeds to answer a web_server request, ' +
+            'the feeds answering later are listed in timed_out_feeds'
+    )
     parser.add_argument(
         '--pg_user',
         default=None,
@@ -230,7 +292,16 @@ if __name__ == '__main__':
     if args.action == 'web_server':
         launch_web_server(args)
     elif args.action == 'vaccum':
-        vaccum(db_conn)
+        print(vaccum(
+            db_conn,
+            drops_per_second=args.vaccum_drops_per_second
+        ))
+    elif args.action == 'gc':
+        print(collect_garbage(
+            db_conn,
+            dry_run=not args.gc_apply,
+            drops_per_second=args.vaccum_drops_per_second
+        ))
     elif args.action == 'snapshot':
         if not args.snapshot_dir:
             print('Please provide a snapshot directory')
@@ -249,6 +320,12 @@ if __name__ == '__main__':
         if not args.snapshot_dir:
             print('Please provide a snapshot directory')
             exit(1)
+        # the restored meta_history holds an older catalog version
+        try:
+            db_conn['meta_history']
+            catalog_version = get_catalog_version(db_conn)
+        except KeyError:
+            catalog_version = None
         snapshot_restore(
             args.host,
             args.port,
@@ -257,3 +334,8 @@ if __name__ == '__main__':
             args.db,
             args.snapshot_dir
         )
+        # the restored catalog replaces the cached ones
+        bump_catalog_version(
+            db_conn,
+            min_version=catalog_version['version'] if catalog_version else 0
+        )
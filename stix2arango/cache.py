@@ -0,0 +1,276 @@
+from bisect import bisect_left
+from collections import OrderedDict
+from threading import Lock
+from weakref import WeakKeyDictionary
+
+from pyArango.theExceptions import CreationError
+
+# collections and indexes known to exist, per database connection
+known_collections = WeakKeyDictionary()
+known_indexes = WeakKeyDictionary()
+# guards known_collections and known_indexes, the database calls are
+# made outside of it
+known_lock = Lock()
+# feed catalogs, per database connection
+feed_catalogs = WeakKeyDictionary()
+feed_catalogs_lock = Lock()
+
+
+class LRUCache:
+    """A bounded mapping evicting the least recently used entries,
+    which counts hits and misses.
+    """
+
+    def __init__(self, capacity=1000):
+        """Initialize the cache
+
+        Args:
+            capacity (int, optional): maximum number of entries. \
+                Defaults to 1000.
+        """
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, key, default=None):
+        """Get an entry and mark it as recently used
+
+        Args:
+            key (hashable): the entry key
+            default (optional): value returned on a miss. Defaults to None.
+
+        Returns:
+            the cached value or default
+        """
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Add an entry, evicting the least recently used one when full
+
+        Args:
+            key (hashable): the entry key
+            value: the value to cache
+        """
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """Remove every entry, counters are kept"""
+        with self.lock:
+            self.entries.clear()
+
+    def info(self):
+        """Get the cache statistics
+
+        Returns:
+            dict: hits, misses, hit_rate, size and capacity of the cache
+        """
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self.entries),
+            'capacity': self.capacity
+        }
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class Timeline:
+    """The generations of a feed, sorted by date."""
+
+    def __init__(self, generations):
+        """Initialize the timeline
+
+        Args:
+            generations (list): (timestamp, value) tuples
+        """
+        generations = sorted(generations, key=lambda g: g[0])
+        self.dates = [date for date, _ in generations]
+        self.values = [value for _, value in generations]
+
+    def last(self):
+        """Get the newest generation
+
+        Returns:
+            the value of the newest generation, None if empty
+        """
+        if len(self.values) == 0:
+            return None
+        return self.values[-1]
+
+    def before(self, timestamp):
+        """Get the newest generation strictly older than a date
+
+        Args:
+            timestamp (float): the date
+
+        Returns:
+            the value of the generation, None if there is none
+        """
+        i = bisect_left(self.dates, timestamp)
+        if i == 0:
+            return None
+        return self.values[i - 1]
+
+    def __len__(self):
+        return len(self.values)
+
+
+class FeedCatalog:
+    """Timelines of the feeds of a database, refreshed from the catalog \
+    version.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.timelines = {}
+        self.lock = Lock()
+
+    def stale_feeds(self, catalog_version):
+        """Get the feeds changed since the last synchronization
+
+        Args:
+            catalog_version (dict): the catalog version document
+
+        Returns:
+            list: names of the changed feeds, None if every timeline \
+                must be loaded again
+        """
+        if self.version is None or \
+            catalog_version.get('reset', 0) > self.version:
+            return None
+        return [name for name, version in catalog_version.get('feeds', {}).items()
+            if version > self.version]
+
+    def update(self, version, timelines, names=None):
+        """Replace the timelines of some feeds
+
+        Args:
+            version (int): the catalog version read before loading timelines
+            timelines (dict): loaded timelines, by feed name
+            names (list, optional): names of the reloaded feeds, \
+                None if every timeline was loaded. Defaults to None.
+        """
+        if names is None:
+            self.timelines = timelines
+        else:
+            for name in names:
+                if name in timelines:
+                    self.timelines[name] = timelines[name]
+                else:
+                    self.timelines.pop(name, None)
+        self.version = version
+
+    def info(self):
+        """Get the catalog statistics
+
+        Returns:
+            dict: the catalog version, the number of feeds and generations
+        """
+        return {
+            'version': self.version,
+            'feeds': len(self.timelines),
+            'generations': sum(len(t) for t in self.timelines.values())
+        }
+
+
+def get_feed_catalog(db_conn):
+    """Get the feed catalog shared by the users of a connection
+
+    Args:
+        db_conn (pyarango database): the database connection
+
+    Returns:
+        FeedCatalog: the catalog
+    """
+    with feed_catalogs_lock:
+        if db_conn not in feed_catalogs:
+            feed_catalogs[db_conn] = FeedCatalog()
+        return feed_catalogs[db_conn]
+
+
+def ensure_collection(db_conn, name, class_name='Collection'):
+    """Create a collection if it was not seen yet on this connection
+
+    Args:
+        db_conn (pyarango database): the database connection
+        name (str): the collection name
+        class_name (str, optional): 'Collection' or 'Edges'. \
+            Defaults to 'Collection'.
+    """
+    with known_lock:
+        if name in known_collections.get(db_conn, ()):
+            return
+    try:
+        db_conn.createCollection(className=class_name, name=name)
+    except CreationError:
+        pass
+    with known_lock:
+        known_collections.setdefault(db_conn, set()).add(name)
+
+
+def ensure_index(db_conn, col_name, fields, index_type='persistent', **index_args):
+    """Create an index if it was not seen yet on this connection
+
+    Args:
+        db_conn (pyarango database): the database connection
+        col_name (str): the collection name
+        fields (list): the indexed fields
+        index_type (str, optional): the index type. Defaults to 'persistent'.
+    """
+    index = (col_name, index_type, tuple(fields))
+    with known_lock:
+        if index in known_indexes.get(db_conn, ()):
+            return
+    db_conn[col_name].ensureIndex(
+        index_type=index_type,
+        fields=fields,
+        **index_args
+    )
+    with known_lock:
+        known_indexes.setdefault(db_conn, set()).add(index)
+
+
+def forget_collection(db_conn, name):
+    """Invalidate the cached state of a removed collection
+
+    Args:
+        db_conn (pyarango database): the database connection
+        name (str): the collection name
+    """
+    with known_lock:
+        known_collections.get(db_conn, set()).discard(name)
+        indexes = known_indexes.get(db_conn, set())
+        for index in [index for index in indexes if index[0] == name]:
+            indexes.discard(index)
+
+
+def forget_collections(db_conn):
+    """Invalidate the cached state of all the collections of a connection, \
+        they may have been dropped by another process
+
+    Args:
+        db_conn (pyarango database): the database connection
+    """
+    with known_lock:
+        known_collections.pop(db_conn, None)
+        known_indexes.pop(db_conn, None)
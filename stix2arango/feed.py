@@ -1,72 +1,324 @@
-import copy
+import itertools
+import os
+import time
+from threading import Lock
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from operator import is_
 from pickle import GLOBAL
 from pickletools import optimize
-from pyArango.theExceptions import (
-    CreationError,
-    DeletionError)
+from pyArango.theExceptions import DeletionError
 from datetime import datetime, timedelta
-from stix2arango.postgresql import PostgresOptimizer
+from stix2arango.postgresql import PostgresOptimizer, delete_field_in_object
 
-from stix2arango.storage import TIME_BASED, STATIC, STORAGE_PARADIGMS, GROUPED
+from stix2arango.storage import (
+    TIME_BASED,
+    STATIC,
+    STORAGE_PARADIGMS,
+    GROUPED,
+    Grouped,
+    GroupedByTime)
 from stix2arango import stix_modifiers
-from stix2arango.utils import is_valid_feed_name
+from stix2arango.utils import (
+    is_valid_feed_name,
+    iter_stix_file,
+    object_digest,
+    stix_id_to_key,
+    RateLimiter)
+from stix2arango.cache import (
+    LRUCache,
+    ensure_collection,
+    ensure_index,
+    forget_collection,
+    forget_collections,
+    get_feed_catalog,
+    Timeline)
 from stix2arango import version
 from stix2arango.postgresql import PostgresOptimizer
 from stix2arango.exceptions import InvalidFeedName, InvalidObjectForOptimizer
 
+# default number of documents written per round-trip
+DEFAULT_BATCH_SIZE = 1000
+# default number of stored documents remembered for deduplication
+DEFAULT_DEDUP_CACHE_SIZE = 10000
+# attribute storing the content fingerprint of documents in delta mode
+FINGERPRINT_FIELD = '_stix2arango_fingerprint'
+# number of written edges remembered to collapse duplicates between batches
+EDGE_MEMORY_SIZE = 100000
+# number of collections dropped concurrently by vaccum
+VACCUM_WORKERS = 8
+# meta_history document counting the changes of the feed catalog
+CATALOG_VERSION_KEY = 'catalog_version'
+# storage paradigms always requested on their last generation
+ALWAYS_LAST = [
+    STORAGE_PARADIGMS.index(STATIC) + 1,
+    STORAGE_PARADIGMS.index(GROUPED) + 1
+]
+
+
+def bump_catalog_version(db_conn, feed_names=None, min_version=0):
+    """Increment the feed catalog version, so that cached catalogs \
+        are read again.
+
+    Args:
+        db_conn (pyarango database): the database connection
+        feed_names (list, optional): names of the changed feeds, every \
+            feed is read again when None. Defaults to None.
+        min_version (int, optional): the new version is greater than \
+            this one, e.g. the version before a restore rewound the \
+            counter. Defaults to 0.
+    """
+    ensure_collection(db_conn, 'meta_history')
+    aql = """LET names = @names == null ? [] : @names
+        UPSERT {_key: @key}
+        INSERT {
+            _key: @key,
+            version: @min + 1,
+            feeds: ZIP(names, names[* RETURN @min + 1]),
+            reset: @names == null ? @min + 1 : 0
+        }
+        UPDATE {
+            version: MAX([OLD.version, @min]) + 1,
+            feeds: @names == null ? {} : MERGE(
+                OLD.feeds,
+                ZIP(names, names[* RETURN MAX([OLD.version, @min]) + 1])
+            ),
+            reset: @names == null ? MAX([OLD.version, @min]) + 1 : OLD.reset
+        } IN meta_history
+        OPTIONS { exclusive: true, mergeObjects: false }"""
+    db_conn.AQLQuery(aql, bindVars={
+        'key': CATALOG_VERSION_KEY,
+        'names': feed_names,
+        'min': min_version
+    })
+
+
+def get_catalog_version(db_conn):
+    """Get the feed catalog version.
+
+    Args:
+        db_conn (pyarango database): the database connection
+
+    Returns:
+        dict: the version, the version of the last change of each feed \
+            and of the last full change, None if the catalog was never \
+            changed
+    """
+    aql = 'RETURN DOCUMENT("meta_history", @key)'
+    docs = list(db_conn.AQLQuery(
+        aql,
+        rawResults=True,
+        bindVars={'key': CATALOG_VERSION_KEY}
+    ))
+    if len(docs) == 0:
+        return None
+    return docs[0]
+
+
+def drop_collection(db_conn, name):
+    """Drop a collection and its edge collection.
+
+    Args:
+        db_conn (pyarango database): the database connection
+        name (str): the collection name
 
-def vaccum(db_conn):
-    actual_date = datetime.now()
+    Returns:
+        dict: the number of dropped collections and documents
+    """
+    reclaimed = {'collections': 0, 'documents': 0}
+    for col_name in [name, 'edge_' + name]:
+        forget_collection(db_conn, col_name)
+        try:
+            col = db_conn[col_name]
+            documents = col.count()
+            col.delete()
+        except (KeyError, DeletionError):
+            continue
+        reclaimed['collections'] += 1
+        reclaimed['documents'] += documents
+    return reclaimed
+
+
+def vaccum(
+        db_conn,
+        workers=VACCUM_WORKERS,
+        drops_per_second=None,
+        progress=None
+    ):
+    """Remove the feed generations older than their vaccum date.
+
+    Expired generations are selected and removed from meta_history by a \
+    single query on an index on vaccum_date. Collections still used by a \
+    remaining generation are kept, the others are dropped in parallel and \
+    postgres tables with a single statement.
+
+    Args:
+        db_conn (pyarango database): the database connection
+        workers (int, optional): number of collections dropped \
+            concurrently. Defaults to VACCUM_WORKERS.
+        drops_per_second (float, optional): limit the rate of collection \
+            drops, unlimited when None. Defaults to None.
+        progress (callable, optional): called with the number of dropped \
+            and of expired collections after each drop. Defaults to None.
+
+    Returns:
+        dict: the number of removed generations, dropped collections, \
+            documents and postgres tables, and the duration in seconds
+    """
+    start = time.time()
+    report = {
+        'generations': 0,
+        'collections': 0,
+        'documents': 0,
+        'tables': 0,
+        'seconds': 0.0
+    }
     colname = 'meta_history'
-    col = db_conn[colname]
-    docs = col.fetchAll()
+    try:
+        db_conn[colname]
+    except KeyError:
+        return report
+    ensure_index(db_conn, colname, ['vaccum_date'], sparse=True)
+    aql = """FOR d IN meta_history
+        FILTER d.vaccum_date != null AND d.vaccum_date <= @now
+        REMOVE d IN meta_history
+        RETURN OLD"""
+    docs = list(db_conn.AQLQuery(
+        aql,
+        rawResults=True,
+        batchSize=1000,
+        bindVars={'now': int(datetime.now().timestamp())}
+    ))
+    report['generations'] = len(docs)
+    if len(docs) == 0:
+        report['seconds'] = time.time() - start
+        return report
+    feed_names = sorted({doc['feed_name'] for doc in docs})
+    bump_catalog_version(db_conn, feed_names)
+
+    # grouped generations share their collections
+    aql = """FOR d IN meta_history
+        FILTER d.feed_name IN @names
+        RETURN d"""
+    remaining = db_conn.AQLQuery(
+        aql,
+        rawResults=True,
+        batchSize=1000,
+        bindVars={'names': feed_names}
+    )
+    used = set()
+    for doc in remaining:
+        feed = Feed.from_doc(db_conn, doc)
+        used.add(feed.storage_paradigm.get_collection_name(feed))
+    report.update(drop_generations(
+        db_conn,
+        docs,
+        used=used,
+        workers=workers,
+        drops_per_second=drops_per_second,
+        progress=progress
+    ))
+    report['seconds'] = time.time() - start
+    return report
+
+
+def drop_generations(
+        db_conn,
+        docs,
+        used=set(),
+        workers=VACCUM_WORKERS,
+        drops_per_second=None,
+        progress=None
+    ):
+    """Drop the collections and optimizer tables of feed generations.
+
+    Args:
+        db_conn (pyarango database): the database connection
+        docs (list): meta_history documents of the generations
+        used (set, optional): collections to keep, used by other \
+            generations. Defaults to set().
+        workers (int, optional): number of collections dropped \
+            concurrently. Defaults to VACCUM_WORKERS.
+        drops_per_second (float, optional): limit the rate of collection \
+            drops, unlimited when None. Defaults to None.
+        progress (callable, optional): called with the number of dropped \
+            and of expired collections after each drop. Defaults to None.
+
+    Returns:
+        dict: the number of dropped collections, documents and tables
+    """
+    report = {'collections': 0, 'documents': 0, 'tables': 0}
+    col_names = set()
+    table_names = set()
     for doc in docs:
-        date = datetime.fromtimestamp(doc['date'])
-        if 'vaccum_date' in doc:
-            vaccum_date = datetime.fromtimestamp(doc['vaccum_date'])
-            try:
-                optimizers = doc['optimizers']
-            except KeyError:
-                optimizers = None
-            feed = Feed(
-                db_conn,
-                doc['feed_name'],
-                doc['tags'],
-                date,
-                doc['storage_paradigm'],
-                vaccum_date
-            )
-            if feed.vaccum_date != 0 and feed.vaccum_date <= actual_date:
-                # remove doc
-                doc.delete()
-
-                # remove collection
-                col_name = feed.storage_paradigm.get_collection_name(feed)
-                edge_col_name = 'edge_' + col_name
-                # remove col 
-                try:
-                    col = db_conn[col_name]
-                    col.delete()
-                except DeletionError:
-                    pass
-                # remove edge col
-                try:
-                    edge_col = db_conn[edge_col_name]
-                    edge_col.delete()
-                except DeletionError:
-                    pass
-                # remove pg table
-                if optimizers:
-                    for opti in optimizers:
-                        if opti['class'] == 'postgresoptimizer' and \
-                            PostgresOptimizer.postgres_conn:
-                            table_name = feed.storage_paradigm.get_collection_name(feed) + opti['uuid']
-                            sql = 'drop table if exists ' + table_name
-                            cursor = PostgresOptimizer.postgres_conn.cursor()
-                            cursor.execute(sql)
-                            cursor.close()
-                            PostgresOptimizer.postgres_conn.commit()
+        feed = Feed.from_doc(db_conn, doc)
+        col_name = feed.storage_paradigm.get_collection_name(feed)
+        if col_name in used:
+            continue
+        col_names.add(col_name)
+        for optimizer in doc.get('optimizers', []):
+            if type(optimizer) == dict and \
+                optimizer['class'] == 'postgresoptimizer':
+                table_names.add(col_name + optimizer['uuid'])
+
+    db_conn.reload()
+    limiter = RateLimiter(drops_per_second)
+
+    def drop(name):
+        limiter.wait()
+        return drop_collection(db_conn, name)
+
+    with ThreadPoolExecutor(workers) as pool:
+        for i, reclaimed in enumerate(pool.map(drop, sorted(col_names))):
+            report['collections'] += reclaimed['collections']
+            report['documents'] += reclaimed['documents']
+            if progress:
+                progress(i + 1, len(col_names))
+    if table_names and PostgresOptimizer.postgres_conn:
+        sql = 'drop table if exists ' + ', '.join(sorted(table_names))
+        with PostgresOptimizer.postgres_conn.cursor() as cursor:
+            cursor.execute(sql)
+        PostgresOptimizer.postgres_conn.commit()
+        report['tables'] = len(table_names)
+    return report
+
+
+def prepare_object(object, optimizer_fields=[]):
+    """Compute the document stored for a stix object and its relations.
+
+    This function does not depend on the feed, so it can run in \
+        another process.
+
+    Args:
+        object (stix object): the object to prepare
+        optimizer_fields (list, optional): fields stored by the feed \
+            optimizers, which are removed from the document. Defaults to [].
+
+    Returns:
+        tuple: the stored document, the original object as a dict, \
+            the edges (src, dest, label) and the digest of the document
+    """
+    # the object is materialized once, the stored document shares its
+    # values and is never modified in place
+    object_save = dict(object)
+    if len(optimizer_fields) > 0:
+        object = object_save
+        for field in optimizer_fields:
+            object = delete_field_in_object(field, object)
+    elif object_save['type'] in stix_modifiers:
+        object = dict(stix_modifiers[object_save['type']](**object_save))
+    else:
+        object = dict(object_save)
+    # check if there if there is relation in the object
+    edges = []
+    for key in object_save:
+        suffix = key.split('_')[-1]
+        if suffix == 'ref':
+            edges.append((object_save['id'], object_save[key], key))
+        elif suffix == 'refs':
+            for ref in object_save[key]:
+                edges.append((object_save['id'], ref, key))
+    return object, object_save, edges, object_digest(object)
+
 
 class Feed:
     """A Feed is a container for a set of STIX objects."""
@@ -79,7 +331,12 @@ class Feed:
                     date=None,
                     storage_paradigm=TIME_BASED,
                     vaccum_date=None,
-                    inserted_stix_types=[]
+                    inserted_stix_types=[],
+                    batch_size=DEFAULT_BATCH_SIZE,
+                    dedup_cache_size=DEFAULT_DEDUP_CACHE_SIZE,
+                    delta=False,
+                    deterministic_keys=False,
+                    shadow_build=False
                 ):
         """Initialize a Feed object.
 
@@ -94,12 +351,29 @@ class Feed:
                 Defaults to TIME_BASED.
             vaccum_date (datetime, optional): date of the feed deletion. \
                 Defaults to 90 days.
+            batch_size (int, optional): number of documents written to \
+                the database per round-trip. Defaults to 1000.
+            dedup_cache_size (int, optional): number of stored documents \
+                remembered to store identical objects once. Defaults to 10000.
+            delta (bool, optional): for GROUPED and GROUPED_BY_* feeds, \
+                skip unchanged objects and replace changed ones instead \
+                of inserting every object again. Defaults to False.
+            deterministic_keys (bool, optional): derive the _key of each \
+                document from its stix id, so documents and edges are \
+                addressed without lookups. Every object is stored in its \
+                own document. Defaults to False.
+            shadow_build (bool, optional): for STATIC feeds, load the new \
+                objects in a new collection and switch the feed to it once \
+                loaded, so readers never see an empty feed. \
+                Defaults to False.
         """
         if(not(is_valid_feed_name(feed_name))):
             raise InvalidFeedName()
 
         self.obj_inserted = {}
-        self.optimized_obj = {}
+        # stix ids of the objects inserted with deterministic keys
+        self.inserted_ids = set()
+        self.optimized_obj = LRUCache(dedup_cache_size)
         self.db_conn = db_conn
         self.feed_name = feed_name
         self.relations_to_insert = []
@@ -124,142 +398,582 @@ class Feed:
             self.inserted_stix_types = inserted_stix_types
         else:
             self.inserted_stix_types = []
+        # set used for membership tests, the list keeps insertion order
+        self.known_stix_types = set(self.inserted_stix_types)
+        self.stix_types_updated = False
         self.edge_to_insert = []
+        self.inserted_edges = set()
         self.optimizers = []
         self.version = version.__version__
+        self.batch_size = batch_size
+        self.object_buffer = []
+        self.writer_pool = None
+        self.workers = 1
+        self.pending_writes = []
+        self.lock = Lock()
+        self.delta = delta and isinstance(
+            self.storage_paradigm,
+            (Grouped, GroupedByTime)
+        )
+        self.delta_stats = {'new': 0, 'changed': 0, 'unchanged': 0}
+        self.deterministic_keys = deterministic_keys
+        self.shadow_build = shadow_build
+        self.shadow_pending = False
+        # STATIC generation loaded by a shadow build
+        self.generation = None
+        self.insertion_stats = {'objects': 0, 'documents': 0, 'seconds': 0.0}
+
+    @property
+    def objects_per_second(self):
+        """Insertion speed measured on the previous insertions.
+
+        Returns:
+            float: number of stix objects inserted per second
+        """
+        if self.insertion_stats['seconds'] == 0:
+            return 0.0
+        return self.insertion_stats['objects'] / self.insertion_stats['seconds']
 
     def drop(self):
         """
-        Drop actual feed's collections
+        Drop actual feed's collections, and the collections and optimizer \
+        tables of every generation of the feed
         """
         self.has_been_emptied = True
         self.feed_already_saved = False
+        docs = []
+        colname = 'meta_history'
         try:
-            col_name = self.storage_paradigm.get_collection_name(self)
-            self.db_conn[col_name].delete()
-            self.db_conn['edge_' + col_name].delete()
-        except( KeyError, DeletionError):
+            # reloads the collections on a miss, meta_history may have
+            # been created by another process
+            self.db_conn[colname]
+        except KeyError:
             pass
-        colname = 'meta_history'
-        col = self.db_conn[colname]
-        docs = col.fetchAll()
+        else:
+            ensure_index(self.db_conn, colname, ['feed_name', 'date'])
+            aql = """FOR d IN meta_history
+                FILTER d.feed_name == @name
+                REMOVE d IN meta_history
+                RETURN OLD"""
+            docs = list(self.db_conn.AQLQuery(
+                aql,
+                rawResults=True,
+                batchSize=1000,
+                bindVars={'name': self.feed_name}
+            ))
+        col_name = self.storage_paradigm.get_collection_name(self)
+        drop_generations(self.db_conn, docs)
+        drop_collection(self.db_conn, col_name)
+        for optimizer in self.optimizers:
+            optimizer.table_created = False
+        bump_catalog_version(self.db_conn, [self.feed_name])
 
-        for doc in docs:
-            if doc['feed_name'] == self.feed_name:
-                doc.delete()
+    def drop_storage(self):
+        """
+        Drop the collections and optimizer tables of this feed generation
+        """
+        drop_collection(
+            self.db_conn,
+            self.storage_paradigm.get_collection_name(self)
+        )
+        for optimizer in self.optimizers:
+            optimizer.drop_feed_table(self)
 
     def __insert_one_object(self, object, colname):
-        """Insert a single object in the database.
+        """Buffer a single object, the buffer is written in the database \
+            when it reaches batch_size objects.
 
         Args:
             object (stix object): the object to insert
             colname (str): the name of the collection
+        """
+        self.__buffer_object(
+            prepare_object(object, [o.field for o in self.optimizers]),
+            colname
+        )
+
+    def __buffer_object(self, prepared_object, colname):
+        """Buffer an object returned by prepare_object.
+
+        Args:
+            prepared_object (tuple): the object returned by prepare_object
+            colname (str): the name of the collection
+        """
+        object, object_save, edges, digest = prepared_object
+        if self.delta:
+            # optimizers remove the id, delta matches documents on it
+            object['id'] = object_save['id']
+            object[FINGERPRINT_FIELD] = digest.hex()
+        if object_save['type'] not in self.known_stix_types:
+            self.known_stix_types.add(object_save['type'])
+            self.inserted_stix_types.append(object_save['type'])
+            self.stix_types_updated = True
+
+        ensure_collection(self.db_conn, colname)
+        self.edge_to_insert += edges
+        self.insertion_stats['objects'] += 1
+        if self.deterministic_keys:
+            object['_key'] = stix_id_to_key(object_save['id'])
+            _id = colname + '/' + object['_key']
+            self.__register_object(object_save, _id)
+            self.object_buffer.append([object, [], _id])
+            if len(self.object_buffer) >= self.batch_size:
+                self.__flush_objects(colname)
+            return
+        if self.delta:
+            # each object has its own document, identified by its stix id
+            self.object_buffer.append([object, [object_save], None])
+            if len(self.object_buffer) >= self.batch_size:
+                self.__flush_objects(colname)
+            return
+        # an entry is [stored object, objects sharing it, _id once written]
+        entry = self.optimized_obj.get(digest)
+        if entry is None:
+            entry = [object, [], None]
+            self.optimized_obj.put(digest, entry)
+            self.object_buffer.append(entry)
+        if entry[2]:
+            self.__register_object(object_save, entry[2])
+        else:
+            entry[1].append(object_save)
+        if len(self.object_buffer) >= self.batch_size:
+            self.__flush_objects(colname)
+
+    def get_document_id(self, stix_id):
+        """Get the _id of the document storing a stix object.
+
+        With deterministic keys, the _id is computed from the stix id, \
+            otherwise it is looked up among the objects inserted by this feed.
+            In both cases, the object must have been inserted by this feed.
+
+        Args:
+            stix_id (str): the stix id of the object
+
+        Raises:
+            KeyError: if the object was not inserted by this feed
 
         Returns:
-            pyarango doc: the stored document
+            str: the arango _id of the document
         """
-        object = dict(object)
-        object_save = copy.deepcopy(object)
-        if object['type'] not in self.inserted_stix_types:
-            self.inserted_stix_types.append(object['type'])
-            self.__update_inserted_object_list()
-        
-        if len(self.optimizers) > 0:
-            for optimizer in self.optimizers:
-                object = optimizer.delete_fields_in_object(object)
-        elif object['type'] in stix_modifiers:
-            args = dict(object)
-            object = stix_modifiers[object['type']](**args)
+        if self.deterministic_keys:
+            if stix_id not in self.inserted_ids:
+                raise KeyError(stix_id)
+            colname = self.storage_paradigm.get_collection_name(self)
+            return colname + '/' + stix_id_to_key(stix_id)
+        return self.obj_inserted[stix_id]
 
-        try:
-            self.db_conn.createCollection(className='Collection', name=colname)
-        except CreationError:
-            pass
-        col = self.db_conn[colname]
-        # check if there if there is relation in the object
-        compact = str({k:v for k,v in object.items()})
-        for key in object_save:
-            suffix = key.split('_')[-1]
-            if suffix == 'ref':
-                self.edge_to_insert.append((object_save['id'], object_save[key], key))
-            elif suffix == 'refs':
-                for ref in object_save[key]:
-                    self.edge_to_insert.append((object_save['id'], ref, key))
-        # save doc
-        if len(self.optimized_obj.keys()) > 1000:
-            self.optimized_obj = {}
-        try:
-            doc = self.optimized_obj[compact]
-            self.obj_inserted[object_save['id']] = doc
-        except KeyError:
-            doc = col.createDocument(object)
-            doc.save()
-            self.optimized_obj[compact] = doc
-            self.obj_inserted[object_save['id']] = doc
-        _id = doc['_id']
+    def __register_object(self, object_save, _id):
+        """Bind a stix object to its stored document.
+
+        Args:
+            object_save (dict): the original stix object
+            _id (str): arango _id of the stored document
+        """
+        if self.deterministic_keys:
+            self.inserted_ids.add(object_save['id'])
+        else:
+            self.obj_inserted[object_save['id']] = _id
         for optimizer in self.optimizers:
             try:
                 optimizer.insert_stix_obj(object_save, _id, self)
             except InvalidObjectForOptimizer:
                 pass
-        return doc
 
-    def insert_stix_object_in_arango(self, l_object):
-        """Insert a list of stix objects in the database.
+    def __flush_objects(self, colname):
+        """Write the buffered objects in the database.
+
+        When a writer pool is running, the write is done in background \
+            and the _ids are bound later by __complete_writes.
 
         Args:
-            l_object (list): the list of stix objects to insert
+            colname (str): the name of the collection
+        """
+        if len(self.object_buffer) == 0:
+            return
+        buffer = self.object_buffer
+        self.object_buffer = []
+        docs = [entry[0] for entry in buffer]
+        if self.delta:
+            write = self.__write_delta
+        else:
+            write = self.__write_documents
+        if self.writer_pool:
+            future = self.writer_pool.submit(write, colname, docs)
+            self.pending_writes.append((future, buffer))
+            self.__complete_writes(self.workers)
+        else:
+            self.__bind_ids(buffer, write(colname, docs))
+            self.__insert_edge_in_arango(final=False)
+        self.__update_inserted_object_list()
+
+    def __complete_writes(self, max_pending=0):
+        """Wait for background writes until at most max_pending remain.
+
+        Args:
+            max_pending (int, optional): writes allowed to stay pending. \
+                Defaults to 0.
+        """
+        while len(self.pending_writes) > max_pending:
+            future, buffer = self.pending_writes.pop(0)
+            self.__bind_ids(buffer, future.result())
+
+    def __bind_ids(self, buffer, ids):
+        """Bind the written documents _ids to the buffered objects.
+
+        Args:
+            buffer (list): the written buffer entries
+            ids (list): the _ids of the written documents
+        """
+        for entry, _id in zip(buffer, ids):
+            entry[0] = None
+            entry[2] = _id
+            for object_save in entry[1]:
+                self.__register_object(object_save, _id)
+            entry[1] = []
+        self.insertion_stats['documents'] += len(ids)
+
+    def __write_delta(self, colname, docs):
+        """Write only the new and changed documents.
+
+        Documents are matched on their stix id, which is kept even when \
+            optimizers store the other fields. Unchanged documents are \
+            skipped, changed ones are replaced and their outbound edges \
+            are removed, to be created again from the new version.
+
+        Args:
+            colname (str): the name of the collection
+            docs (list): the documents to write
+
+        Returns:
+            list: the _id of the documents, in the same order
+        """
+        lookup = """FOR id IN @ids
+            LET old = FIRST(FOR o IN @@col FILTER o.id == id LIMIT 1 RETURN o)
+            RETURN old == null ? null : {
+                _id: old._id, _key: old._key, fingerprint: old.%s}""" \
+            % FINGERPRINT_FIELD
+        olds = list(self.db_conn.AQLQuery(
+            lookup,
+            rawResults=True,
+            batchSize=self.batch_size,
+            bindVars={'ids': [doc['id'] for doc in docs], '@col': colname}
+        ))
+        ids = [None] * len(docs)
+        new = []
+        changed = []
+        for i, (doc, old) in enumerate(zip(docs, olds)):
+            if old is None:
+                new.append(i)
+            else:
+                ids[i] = old['_id']
+                if old['fingerprint'] != doc[FINGERPRINT_FIELD]:
+                    changed.append((i, old['_key']))
+        new_ids = self.__write_documents(colname, [docs[i] for i in new])
+        for i, _id in zip(new, new_ids):
+            ids[i] = _id
+        if len(changed) > 0:
+            aql = 'FOR r IN @docs REPLACE r._key WITH r.doc IN @@col'
+            self.db_conn.AQLQuery(aql, bindVars={
+                'docs': [{'_key': key, 'doc': docs[i]} for i, key in changed],
+                '@col': colname
+            })
+            edge_colname = 'edge_' + colname
+            try:
+                self.db_conn[edge_colname]
+            except KeyError:
+                pass
+            else:
+                aql = 'FOR e IN @@col FILTER e._from IN @ids REMOVE e IN @@col'
+                self.db_conn.AQLQuery(aql, bindVars={
+                    'ids': [ids[i] for i, _ in changed],
+                    '@col': edge_colname
+                })
+        with self.lock:
+            self.delta_stats['new'] += len(new)
+            self.delta_stats['changed'] += len(changed)
+            self.delta_stats['unchanged'] += len(docs) - len(new) - len(changed)
+        return ids
+
+    def __write_documents(self, colname, docs, pool=None, aql=None):
+        """Insert documents (or edges) using multi-document inserts of \
+            batch_size documents.
+
+        Args:
+            colname (str): the name of the collection
+            docs (list): the documents to insert
+            pool (ThreadPoolExecutor, optional): if set, batches are \
+                written concurrently in this pool. Defaults to None.
+            aql (str, optional): the query writing a batch of @docs in \
+                @@col. Defaults to a multi-document insert.
+
+        Returns:
+            list: the _id of the inserted documents, in the same order
+        """
+        if not aql and self.deterministic_keys:
+            # an object inserted again replaces its previous version
+            aql = """FOR d IN @docs INSERT d INTO @@col
+                OPTIONS { overwriteMode: "replace" } RETURN NEW._id"""
+        elif not aql:
+            aql = 'FOR d IN @docs INSERT d INTO @@col RETURN NEW._id'
+
+        def write_batch(batch):
+            bind_vars = {'docs': batch, '@col': colname}
+            return list(self.db_conn.AQLQuery(
+                aql,
+                rawResults=True,
+                batchSize=self.batch_size,
+                bindVars=bind_vars
+            ))
+        batches = [docs[i:i + self.batch_size]
+            for i in range(0, len(docs), self.batch_size)]
+        if pool:
+            results = pool.map(write_batch, batches)
+        else:
+            results = map(write_batch, batches)
+        ids = []
+        for batch_ids in results:
+            ids += batch_ids
+        return ids
+
+    def __prepare_insertion(self):
+        """Empty STATIC feeds and save the feed before an insertion.
+
+        Returns:
+            str: the name of the collection to insert in
         """
         if self.storage_paradigm == STATIC and not(self.has_been_emptied):
-            self.drop()
-            for optimizer in self.optimizers:
-                optimizer.drop_table(self.feed_name)
+            if self.shadow_build:
+                # readers keep using the previous generation until the
+                # new one is loaded
+                self.generation = int(time.time() * 1000)
+                self.has_been_emptied = True
+                self.shadow_pending = True
+            else:
+                self.drop()
         self.db_conn.reload()
-        if not self.feed_already_saved:
+        # vaccum or gc may have dropped collections since the last run
+        forget_collections(self.db_conn)
+        if not self.feed_already_saved and not self.shadow_pending:
             self.__save_feed()
             self.feed_already_saved = True
         colname = self.storage_paradigm.get_collection_name(self)
+        if self.delta:
+            ensure_collection(self.db_conn, colname)
+            ensure_index(self.db_conn, colname, ['id'], sparse=True)
+        return colname
+
+    def insert_stix_object_in_arango(self, l_object):
+        """Insert a list of stix objects in the database.
+
+        Args:
+            l_object (iterable): the list of stix objects to insert, \
+                any iterable is consumed lazily
+        """
+        start = time.time()
+        colname = self.__prepare_insertion()
         for object in l_object:
             self.__insert_one_object(object, colname)
+        self.__flush_objects(colname)
         self.__insert_edge_in_arango()
+        self.__finish_insertion()
+        self.insertion_stats['seconds'] += time.time() - start
+
+    def insert_stix_object_in_arango_parallel(self, l_object, workers=None):
+        """Insert a list of stix objects using several workers.
+
+        Objects are converted in a pool of processes, documents are \
+            written by a pool of threads sending concurrent requests, \
+            and edges are created once every vertex is stored.
+
+        Args:
+            l_object (iterable): the list of stix objects to insert
+            workers (int, optional): number of processes and of writer \
+                threads. Defaults to the number of cpus.
+        """
+        start = time.time()
+        colname = self.__prepare_insertion()
+        self.workers = workers or os.cpu_count()
+        fields = [optimizer.field for optimizer in self.optimizers]
+        l_object = iter(l_object)
+        with ProcessPoolExecutor(self.workers) as processes, \
+                ThreadPoolExecutor(self.workers) as writers:
+            self.writer_pool = writers
+            try:
+                # objects are sent to the processes by slices to keep
+                # memory bounded on huge iterators
+                chunk = [dict(o) for o in itertools.islice(
+                    l_object, self.batch_size * self.workers)]
+                while len(chunk) > 0:
+                    prepared_objects = processes.map(
+                        prepare_object,
+                        chunk,
+                        itertools.repeat(fields),
+                        chunksize=max(1, len(chunk) // self.workers)
+                    )
+                    for prepared_object in prepared_objects:
+                        self.__buffer_object(prepared_object, colname)
+                    chunk = [dict(o) for o in itertools.islice(
+                        l_object, self.batch_size * self.workers)]
+                self.__flush_objects(colname)
+                self.__complete_writes()
+            finally:
+                self.writer_pool = None
+            self.__insert_edge_in_arango(pool=writers)
+        self.__finish_insertion()
+        self.insertion_stats['seconds'] += time.time() - start
+
+    def insert_stix_stream(self, source):
+        """Insert stix objects from an iterator or from a file.
+
+        Objects are consumed one by one and written by batches, so memory \
+            stays bounded by batch_size whatever the size of the source.
+
+        Args:
+            source (str|iterable): path to a stix bundle (JSON) or to a \
+                JSONL file, or an iterable of stix objects
+        """
+        if isinstance(source, (str, os.PathLike)):
+            source = iter_stix_file(source)
+        self.insert_stix_object_in_arango(source)
+
+    def __finish_insertion(self):
+        """Switch a shadow build to the new generation and save the \
+            inserted stix types."""
+        if self.shadow_pending:
+            self.__swap_generation()
+        self.__update_inserted_object_list()
+
+    def __swap_generation(self):
+        """Point a STATIC feed to the generation loaded by a shadow build, \
+            then drop the previous generations."""
+        colname = self.storage_paradigm.get_collection_name(self)
+        ensure_collection(self.db_conn, colname)
+        ensure_collection(self.db_conn, 'edge_' + colname, class_name='Edges')
+        ensure_collection(self.db_conn, 'meta_history')
+        aql = """FOR d IN meta_history FILTER d.feed_name == @name
+            SORT d.date DESC RETURN d"""
+        previous_docs = list(self.db_conn.AQLQuery(
+            aql,
+            rawResults=True,
+            bindVars={'name': self.feed_name}
+        ))
+        previous_feeds = [Feed.from_doc(self.db_conn, doc)
+            for doc in previous_docs]
+        if len(previous_feeds) > 0:
+            # indexes created by requests on the previous generation
+            previous_colname = previous_feeds[0].storage_paradigm\
+                .get_collection_name(previous_feeds[0])
+            try:
+                indexes = self.db_conn[previous_colname].getIndexes()
+            except KeyError:
+                indexes = {'persistent': {}}
+            for index in indexes['persistent'].values():
+                ensure_index(
+                    self.db_conn,
+                    colname,
+                    index.infos['fields'],
+                    sparse=index.infos.get('sparse', False),
+                    unique=index.infos.get('unique', False)
+                )
+            # a single document replacement switches readers atomically
+            self.key = previous_feeds[0].key
+            _dict = self.__dict__()
+            _dict['_key'] = self.key
+            self.db_conn.AQLQuery(
+                'REPLACE @feed IN meta_history',
+                bindVars={'feed': _dict}
+            )
+        else:
+            self.__save_feed()
+        self.feed_already_saved = True
+        self.shadow_pending = False
+        self.stix_types_updated = False
+        # remove previous generations
+        aql = """FOR d IN meta_history FILTER d.feed_name == @name
+            AND d._key != @key REMOVE d IN meta_history"""
+        self.db_conn.AQLQuery(
+            aql,
+            bindVars={'name': self.feed_name, 'key': self.key}
+        )
+        bump_catalog_version(self.db_conn, [self.feed_name])
+        for feed in previous_feeds:
+            if feed.storage_paradigm.get_collection_name(feed) != colname:
+                feed.drop_storage()
 
     def __update_inserted_object_list(self):
-        _dict = self.__dict__()
-        _dict['_key'] = self.key
-        aql = """REPLACE %s in meta_history """ % (_dict)
-        self.db_conn.AQLQuery(aql)
+        """Save the inserted stix types in meta_history, if new types \
+            were inserted since the last call."""
+        if not self.stix_types_updated or self.key is None:
+            return
+        aql = """UPDATE @key WITH {inserted_stix_types: @types}
+            IN meta_history"""
+        self.db_conn.AQLQuery(aql, bindVars={
+            'key': self.key,
+            'types': self.inserted_stix_types
+        })
+        bump_catalog_version(self.db_conn, [self.feed_name])
+        self.stix_types_updated = False
 
-    def __insert_edge_in_arango(self):
-        """Insert the edges in the database."""
+    def __insert_edge_in_arango(self, final=True, pool=None):
+        """Insert the edges in the database.
+
+        Edges sharing the same (_from, _to, label) are written once, \
+            then edges are written by batches of batch_size.
+
+        Args:
+            final (bool, optional): if False, edges pointing to objects \
+                not inserted yet are kept for a next call. Defaults to True.
+            pool (ThreadPoolExecutor, optional): if set, edge batches are \
+                written concurrently in this pool. Defaults to None.
+        """
         colname = 'edge_' + self.storage_paradigm.get_collection_name(self)
-        try:
-            self.db_conn.createCollection(className='Edges', name=colname)
-        except CreationError:
-            pass
-        col = self.db_conn[colname]
+        ensure_collection(self.db_conn, colname, class_name='Edges')
+        if len(self.inserted_edges) > EDGE_MEMORY_SIZE:
+            self.inserted_edges = set()
+        edges = {}
+        unresolved = []
         for src, dest, label in self.edge_to_insert:
             try:
-                edge = {"_from": self.obj_inserted[src]._id,
-                        "_to": self.obj_inserted[dest]._id,
-                        "label": label}
-            except KeyError:                
+                edge = (
+                    self.get_document_id(src),
+                    self.get_document_id(dest),
+                    label
+                )
+            except KeyError:
+                if not final:
+                    unresolved.append((src, dest, label))
+                    continue
                 raise RuntimeError("""Error while trying to create a 
                 relation with a non-existing object...""")
-            doc = col.createDocument(edge)
-            doc.save()
-        self.edge_to_insert = []
+            if edge not in self.inserted_edges:
+                edges[edge] = True
+        aql = 'FOR d IN @docs INSERT d INTO @@col RETURN NEW._id'
+        if self.delta:
+            # edges of unchanged objects are already stored
+            aql = """FOR d IN @docs
+                FILTER LENGTH(FOR e IN @@col FILTER e._from == d._from
+                    AND e._to == d._to AND e.label == d.label
+                    LIMIT 1 RETURN 1) == 0
+                INSERT d INTO @@col RETURN NEW._id"""
+        self.__write_documents(
+            colname,
+            [{"_from": _from, "_to": _to, "label": label}
+                for _from, _to, label in edges],
+            pool=pool,
+            aql=aql
+        )
+        self.inserted_edges.update(edges)
+        self.edge_to_insert = unresolved
 
     def __save_feed(self):
         """Save the feed in the database."""
         colname = 'meta_history'
-        try:
-            self.db_conn.createCollection(className='Collection', name=colname)
-        except CreationError as e:
-            pass
+        ensure_collection(self.db_conn, colname)
         col = self.db_conn[colname]
         doc = col.createDocument(self.__dict__())
         doc.save()
         self.key = doc._key
+        bump_catalog_version(self.db_conn, [self.feed_name])
         return doc
 
     def __dict__(self):
@@ -277,63 +991,180 @@ class Feed:
             'version': self.version,
             'inserted_stix_types': self.inserted_stix_types,
             'vaccum_date': int(self.vaccum_date.timestamp()),
-            'optimizers' : optimizers_dict
+            'optimizers' : optimizers_dict,
+            'generation': self.generation
         }
 
     def __str__(self):
         return 'Feed: {}'.format(self.__dict__())
 
-    def get_last_feeds(db_conn, d_before, postgres_conn=None):
+    @staticmethod
+    def from_doc(db_conn, doc):
+        """Build a Feed from its meta_history document.
+
+        Args:
+            db_conn (pyarango database): the database connection
+            doc (dict): the meta_history document
+
+        Returns:
+            Feed: the feed, with its optimizers if postgres is connected
+        """
+        date = datetime.fromtimestamp(doc['date'])
+        if 'vaccum_date' in doc:
+            vaccum_date = datetime.fromtimestamp(doc['vaccum_date'])
+        else:
+            vaccum_date = 0
+        inserted_stix_types = None
+        if 'inserted_stix_types' in doc:
+            inserted_stix_types = doc['inserted_stix_types']
+        feed = Feed(
+            db_conn,
+            doc['feed_name'],
+            doc['tags'], date,
+            doc['storage_paradigm'],
+            vaccum_date,
+            inserted_stix_types=inserted_stix_types
+            )
+        feed.key = doc['_key']
+        if 'generation' in doc:
+            feed.generation = doc['generation']
+        if 'optimizers' in doc:
+            for doc_optimizer in doc['optimizers']:
+                if type(doc_optimizer) != dict:
+                    continue
+                elif doc_optimizer['class'] == 'postgresoptimizer':
+                    try:
+                        optimizer = PostgresOptimizer(doc_optimizer['field'])
+                        optimizer.uuid = doc_optimizer['uuid']
+                        feed.optimizers.append(optimizer)
+                    except RuntimeError:
+                        pass
+        return feed
+
+    def get_last_feeds(
+            db_conn,
+            d_before,
+            postgres_conn=None,
+            tags=[],
+            stix_type=None
+        ):
         """Get the last feeds before a certain date.
 
+        The generations of each feed are kept in a sorted timeline per \
+        connection, refreshed for the feeds changed since the last call, \
+        the returned feeds are shared. Without catalog version, the last \
+        generations are selected by a single query.
+
         Args:
             db_conn (pyarango database): the database connection
             d_before (datetime): the date before which we want the feeds
+            tags (list, optional): keep feeds carrying all tags. \
+                Defaults to [].
+            stix_type (str, optional): keep feeds where objects of this \
+                type were inserted. Defaults to None.
 
         Returns:
             list: the list of feeds
         """
-        # get all docs from meta_history collection
         colname = 'meta_history'
         try:
-            col = db_conn[colname]
+            # reloads the collections on a miss, meta_history may have
+            # been created by another process
+            db_conn[colname]
         except KeyError:
             return []
-        docs = col.fetchAll()
+        ensure_index(db_conn, colname, ['feed_name', 'date'])
+        catalog_version = get_catalog_version(db_conn)
+        if catalog_version is None:
+            return Feed.__query_last_feeds(db_conn, d_before, tags, stix_type)
+        catalog = get_feed_catalog(db_conn)
+        with catalog.lock:
+            Feed.__sync_catalog(db_conn, catalog, catalog_version)
+            timelines = list(catalog.timelines.values())
+        feeds = []
+        for timeline in timelines:
+            generation = timeline.last()
+            if generation['doc']['storage_paradigm'] not in ALWAYS_LAST:
+                generation = timeline.before(d_before.timestamp())
+            if generation is None:
+                continue
+            doc = generation['doc']
+            if not set(tags).issubset(set(doc['tags'])):
+                continue
+            if stix_type is not None and \
+                not doc.get('version', '').startswith('0.') and \
+                stix_type not in doc.get('inserted_stix_types', []):
+                continue
+            if generation['feed'] is None:
+                generation['feed'] = Feed.from_doc(db_conn, doc)
+            feeds.append(generation['feed'])
+        return feeds
 
-        results_feeds = {}
+    def __sync_catalog(db_conn, catalog, catalog_version):
+        """Load the timelines of the feeds changed since the last call.
+
+        Args:
+            db_conn (pyarango database): the database connection
+            catalog (FeedCatalog): the catalog of the connection
+            catalog_version (dict): the catalog version document
+        """
+        names = catalog.stale_feeds(catalog_version)
+        if names is not None and len(names) == 0:
+            return
+        aql = """FOR d IN meta_history
+            FILTER d.feed_name != null
+            FILTER @names == null OR d.feed_name IN @names
+            RETURN d"""
+        docs = db_conn.AQLQuery(
+            aql,
+            rawResults=True,
+            batchSize=1000,
+            bindVars={'names': names}
+        )
+        generations = {}
         for doc in docs:
-            date = datetime.fromtimestamp(doc['date'])
-            if 'vaccum_date' in doc:
-                vaccum_date = datetime.fromtimestamp(doc['vaccum_date'])
-            else:
-                vaccum_date = 0
-            inserted_stix_types = None
-            if 'inserted_stix_types' in doc:
-                inserted_stix_types = doc['inserted_stix_types']
-            feed = Feed(
-                db_conn,
-                doc['feed_name'],
-                doc['tags'], date,
-                doc['storage_paradigm'],
-                vaccum_date,
-                inserted_stix_types=inserted_stix_types
-                )
-            if 'optimizers' in doc:
-                for doc_optimizer in doc['optimizers']:
-                    if type(doc_optimizer) != dict:
-                        continue
-                    elif doc_optimizer['class'] == 'postgresoptimizer':
-                        try:
-                            optimizer = PostgresOptimizer(doc_optimizer['field'])
-                            optimizer.uuid = doc_optimizer['uuid']
-                            feed.optimizers.append(optimizer)
-                        except RuntimeError:
-                            pass
-            if date.timestamp() < d_before.timestamp() or \
-                feed.storage_paradigm in [STATIC, GROUPED]:
-                if feed.feed_name not in results_feeds:
-                    results_feeds[feed.feed_name] = feed
-                elif feed.date > results_feeds[feed.feed_name].date:
-                    results_feeds[feed.feed_name] = feed
-        return [v for v in results_feeds.values()]
\ No newline at end of file
+            generations.setdefault(doc['feed_name'], []).append(
+                (doc['date'], {'doc': doc, 'feed': None})
+            )
+        timelines = {name: Timeline(g) for name, g in generations.items()}
+        catalog.update(catalog_version['version'], timelines, names)
+
+    def __query_last_feeds(db_conn, d_before, tags, stix_type):
+        """Select the last generation of each feed with a single query.
+
+        Args:
+            db_conn (pyarango database): the database connection
+            d_before (datetime): the date before which we want the feeds
+            tags (list): keep feeds carrying all tags
+            stix_type (str): keep feeds where objects of this type were \
+                inserted
+
+        Returns:
+            list: the list of feeds
+        """
+        aql = """FOR d IN meta_history
+            FILTER d.feed_name != null
+            FILTER d.date < @d_before OR d.storage_paradigm IN @always_last
+            COLLECT name = d.feed_name AGGREGATE last_date = MAX(d.date)
+            LET last = FIRST(
+                FOR f IN meta_history
+                    FILTER f.feed_name == name AND f.date == last_date
+                    LIMIT 1
+                    RETURN f
+            )
+            FILTER @tags ALL IN last.tags
+            FILTER @stix_type == null OR LIKE(last.version, "0.%")
+                OR @stix_type IN last.inserted_stix_types
+            RETURN last"""
+        docs = db_conn.AQLQuery(
+            aql,
+            rawResults=True,
+            batchSize=1000,
+            bindVars={
+                'd_before': d_before.timestamp(),
+                'always_last': ALWAYS_LAST,
+                'tags': list(tags),
+                'stix_type': stix_type
+            }
+        )
+        return [Feed.from_doc(db_conn, doc) for doc in docs]
@@ -0,0 +1,173 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pyArango.theExceptions import DeletionError
+
+from stix2arango.feed import Feed, VACCUM_WORKERS
+from stix2arango.cache import forget_collection
+from stix2arango.postgresql import PostgresOptimizer
+from stix2arango.utils import RateLimiter
+
+# number of collections or tables dropped per batch
+GC_BATCH_SIZE = 100
+# collections younger than this number of seconds may still be loading
+GC_MIN_AGE = 24 * 3600
+# names of the collections created for feed generations, timestamp is in
+# seconds and generation in milliseconds
+COLLECTION_NAME = re.compile(
+    r'^(edge_)?[a-zA-Z0-9_]{0,30}?_((?P<timestamp>\d+)|grouped|static|static_(?P<generation>\d+))$'
+)
+# names of the optimizer tables, <collection><uuid>
+TABLE_NAME = re.compile(
+    r'^(?P<collection>.+)[0-9a-f]{8}_[0-9a-f]{4}_[0-9a-f]{4}_[0-9a-f]{4}_[0-9a-f]{12}$'
+)
+
+
+def referenced_storage(db_conn):
+    """List the collections and optimizer tables used by meta_history.
+
+    Args:
+        db_conn (pyarango database): the database connection
+
+    Returns:
+        tuple: the set of collection names and the set of table names
+    """
+    collections = set()
+    tables = set()
+    try:
+        db_conn['meta_history']
+    except KeyError:
+        return collections, tables
+    aql = """FOR d IN meta_history
+        FILTER d.feed_name != null
+        RETURN d"""
+    docs = db_conn.AQLQuery(aql, rawResults=True, batchSize=1000)
+    for doc in docs:
+        feed = Feed.from_doc(db_conn, doc)
+        col_name = feed.storage_paradigm.get_collection_name(feed)
+        collections.add(col_name)
+        collections.add('edge_' + col_name)
+        for optimizer in doc.get('optimizers', []):
+            if type(optimizer) == dict and \
+                optimizer['class'] == 'postgresoptimizer':
+                # postgres folds unquoted names to lower case
+                tables.add((col_name + optimizer['uuid']).lower())
+    return collections, tables
+
+
+def find_orphans(db_conn, min_age=GC_MIN_AGE):
+    """Find the feed collections and optimizer tables no feed refers to.
+
+    Args:
+        db_conn (pyarango database): the database connection
+        min_age (int, optional): timestamped and shadow build collections \
+            younger than this number of seconds are kept. \
+            Defaults to GC_MIN_AGE.
+
+    Returns:
+        tuple: the sorted list of orphan collections and of orphan tables
+    """
+    # the storage is listed before reading meta_history, so a feed saved
+    # in between is referenced rather than taken for an orphan
+    db_conn.reload()
+    existing_collections = list(db_conn.collections)
+    existing_tables = []
+    if PostgresOptimizer.postgres_conn:
+        existing_tables = PostgresOptimizer.list_all_table()
+    collections, tables = referenced_storage(db_conn)
+    now = time.time()
+    orphan_collections = []
+    for name in existing_collections:
+        match = COLLECTION_NAME.match(name)
+        if not match or name in collections:
+            continue
+        timestamp = match.group('timestamp')
+        if timestamp and now - int(timestamp) < min_age:
+            continue
+        generation = match.group('generation')
+        if generation and now * 1000 - int(generation) < min_age * 1000:
+            continue
+        orphan_collections.append(name)
+    orphan_tables = []
+    if existing_tables:
+        referenced = {name.lower() for name in collections}
+        for name in existing_tables:
+            match = TABLE_NAME.match(name)
+            if not match or name in tables:
+                continue
+            col_name = match.group('collection')
+            if not COLLECTION_NAME.match(col_name) or col_name in referenced:
+                continue
+            orphan_tables.append(name)
+    return sorted(orphan_collections), sorted(orphan_tables)
+
+
+def collect_garbage(
+        db_conn,
+        dry_run=True,
+        batch_size=GC_BATCH_SIZE,
+        workers=VACCUM_WORKERS,
+        drops_per_second=None,
+        min_age=GC_MIN_AGE
+    ):
+    """Drop the collections and optimizer tables left by failed ingestions.
+
+    Args:
+        db_conn (pyarango database): the database connection
+        dry_run (bool, optional): only report orphans. Defaults to True.
+        batch_size (int, optional): number of collections or tables \
+            dropped per batch. Defaults to GC_BATCH_SIZE.
+        workers (int, optional): number of collections dropped \
+            concurrently. Defaults to VACCUM_WORKERS.
+        drops_per_second (float, optional): limit the rate of collection \
+            drops. Defaults to None.
+        min_age (int, optional): shadow build collections younger than \
+            this number of seconds are kept. Defaults to GC_MIN_AGE.
+
+    Returns:
+        dict: orphan collections and tables, the number of dropped ones \
+            and the number of documents in dropped collections
+    """
+    orphan_collections, orphan_tables = find_orphans(db_conn, min_age)
+    report = {
+        'dry_run': dry_run,
+        'collections': orphan_collections,
+        'tables': orphan_tables,
+        'dropped_collections': 0,
+        'dropped_tables': 0,
+        'documents': 0
+    }
+    if dry_run:
+        for name in orphan_collections:
+            report['documents'] += db_conn[name].count()
+        return report
+
+    limiter = RateLimiter(drops_per_second)
+
+    def drop(name):
+        limiter.wait()
+        forget_collection(db_conn, name)
+        try:
+            col = db_conn[name]
+            documents = col.count()
+            col.delete()
+        except (KeyError, DeletionError):
+            return None
+        return documents
+
+    with ThreadPoolExecutor(workers) as pool:
+        for i in range(0, len(orphan_collections), batch_size):
+            batch = orphan_collections[i:i + batch_size]
+            for documents in pool.map(drop, batch):
+                if documents is not None:
+                    report['dropped_collections'] += 1
+                    report['documents'] += documents
+    for i in range(0, len(orphan_tables), batch_size):
+        batch = orphan_tables[i:i + batch_size]
+        sql = 'drop table if exists ' + ', '.join(batch)
+        with PostgresOptimizer.postgres_conn.cursor() as cursor:
+            cursor.execute(sql)
+        PostgresOptimizer.postgres_conn.commit()
+        report['dropped_tables'] += len(batch)
+    return report
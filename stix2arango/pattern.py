@@ -0,0 +1,370 @@
+import re
+
+from stix2arango import stix_modifiers
+from stix2arango.exceptions import (
+    PatternAlreadyContainsType,
+    MalformatedExpression,
+    FieldCanNotBeCalculatedBy)
+from stix2arango.utils import remove_unused_space
+
+# tokens of a stix pattern, strings are not escaped
+TOKEN = re.compile(r"""
+    (?P<space>[ \t\r\n]+)
+    |(?P<string>"[^"]*"|'[^']*')
+    |(?P<open>[(\[])
+    |(?P<close>[)\]])
+    |(?P<operator>!=|<=|>=|==|=|<|>)
+    |(?P<word>(?:[^ \t\r\n\[\]()=<>!'"]|!(?!=))+)
+    |(?P<error>.)
+""", re.VERBOSE)
+CLOSING = {'(': ')', '[': ']'}
+ESCAPED_CHAR = re.compile(r'\\(.)')
+# keywords accepted as values, with numbers and strings
+KEYWORD_VALUES = {'true': True, 'false': False, 'null': None}
+NUMBER = re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$')
+# comparison operators written as words
+OPERATOR_WORDS = ['LIKE', 'MATCHES', 'IN', 'ISSUBSET', 'ISSUPERSET']
+AQL_OPERATORS = {'=': '=='}
+SQL_OPERATORS = {
+    '>': '>',
+    '<': '<',
+    '=': '=',
+    '==': '=',
+    '!=': '!=',
+    '<=': '<=',
+    '>=': '>=',
+    'LIKE': 'LIKE',
+    'NOT LIKE': 'NOT LIKE'
+}
+
+
+def literal_value(text):
+    """Convert a literal of a stix pattern to a python value
+
+    Args:
+        text (str): the literal, as written in the pattern
+
+    Raises:
+        ValueError: if the literal is not a string, a number or a keyword
+
+    Returns:
+        the python value
+    """
+    if text[0] in '"\'':
+        return ESCAPED_CHAR.sub(r'\1', text[1:-1])
+    if text in KEYWORD_VALUES:
+        return KEYWORD_VALUES[text]
+    if not NUMBER.match(text):
+        raise ValueError(text)
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def tokenize(pattern):
+    """Split a stix pattern into tokens in a single pass
+
+    Args:
+        pattern (str): the stix pattern
+
+    Raises:
+        MalformatedExpression: on an unterminated string or a stray \
+            character
+
+    Returns:
+        list: (kind, text) tuples, kind is one of string, open, close, \
+            operator or word
+    """
+    tokens = [(match.lastgroup, match.group())
+        for match in TOKEN.finditer(pattern) if match.lastgroup != 'space']
+    for kind, _ in tokens:
+        if kind == 'error':
+            raise MalformatedExpression(pattern)
+    return tokens
+
+
+class Comparison:
+    """A comparison between an object field and a value"""
+
+    def __init__(self, field, operator, value):
+        self.field = field
+        self.operator = operator
+        self.value = value
+        self.type = field.split(':')[0]
+
+    def modifier_aql(self):
+        """Get the AQL computed by the stix modifier of the object type
+
+        Returns:
+            str: the AQL expression, None if no modifier handles the field
+        """
+        if self.type not in stix_modifiers:
+            return None
+        try:
+            aql = stix_modifiers[self.type].eval(
+                self.field,
+                self.operator,
+                self.value
+            )
+        except FieldCanNotBeCalculatedBy:
+            return None
+        return remove_unused_space(aql).rstrip(' ')
+
+    def bind_value(self, bind_vars):
+        """Add the value of the comparison to the bind variables
+
+        Args:
+            bind_vars (dict): the bind variables of the query
+
+        Returns:
+            str: the placeholder of the value
+        """
+        name = 'v%d' % len(bind_vars)
+        bind_vars[name] = literal_value(self.value)
+        return '@' + name
+
+    def to_aql(self, bind_vars=None):
+        """Compile the comparison to AQL, f being the document
+
+        Args:
+            bind_vars (dict, optional): if set, the value is added to it \
+                and replaced by a bind parameter. Defaults to None.
+
+        Returns:
+            str: the AQL condition
+        """
+        field = 'f.' + '.'.join(self.field.split(':')[1:])
+        operator = AQL_OPERATORS.get(self.operator, self.operator)
+        if bind_vars is None:
+            value = self.value
+        else:
+            value = self.bind_value(bind_vars)
+        return field + ' ' + operator + ' ' + value
+
+    def to_sql(self, column):
+        """Compile the comparison to a psycopg2 SQL condition on a column
+
+        Args:
+            column (str): the column holding the field
+
+        Returns:
+            tuple: the SQL condition and its parameters
+        """
+        return column + ' ' + SQL_OPERATORS[self.operator.upper()] + \
+            ' %s', (literal_value(self.value),)
+
+
+class BooleanExpression:
+    """Comparisons or groups joined by AND or OR"""
+
+    def __init__(self, operator, operands):
+        self.operator = operator
+        self.operands = operands
+
+
+class Group:
+    """An expression between parenthesis or brackets"""
+
+    def __init__(self, operand):
+        self.operand = operand
+
+
+class Parser:
+    """Recursive descent parser of stix patterns"""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.tokens = tokenize(pattern)
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise MalformatedExpression(self.pattern)
+        self.pos += 1
+        return token
+
+    def parse(self):
+        """Parse the whole pattern
+
+        Returns:
+            the root node of the AST
+        """
+        node = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise MalformatedExpression(self.pattern)
+        return node
+
+    def parse_or(self):
+        operands = [self.parse_and()]
+        while self.peek() == ('word', 'OR'):
+            self.pos += 1
+            operands.append(self.parse_and())
+        if len(operands) == 1:
+            return operands[0]
+        return BooleanExpression('OR', operands)
+
+    def parse_and(self):
+        operands = [self.parse_primary()]
+        while self.peek() == ('word', 'AND'):
+            self.pos += 1
+            operands.append(self.parse_primary())
+        if len(operands) == 1:
+            return operands[0]
+        return BooleanExpression('AND', operands)
+
+    def parse_primary(self):
+        kind, text = self.next()
+        if kind == 'open':
+            node = self.parse_or()
+            if self.next() != ('close', CLOSING[text]):
+                raise MalformatedExpression(self.pattern)
+            return Group(node)
+        if kind not in ['word', 'string']:
+            raise MalformatedExpression(self.pattern)
+        left = text
+        operator = self.parse_operator()
+        kind, right = self.next()
+        if kind not in ['word', 'string']:
+            raise MalformatedExpression(self.pattern)
+        if ':' in left and left[0] not in '"\'':
+            field, value = left, right
+        else:
+            field, value = right, left
+        if ':' not in field or field[0] in '"\'' or field.split(':')[0] == '':
+            raise MalformatedExpression(self.pattern)
+        # values are never pasted as AQL, only literals are compared
+        try:
+            literal_value(value)
+        except ValueError:
+            raise MalformatedExpression(self.pattern)
+        return Comparison(field, operator, value)
+
+    def parse_operator(self):
+        kind, text = self.next()
+        if kind == 'operator':
+            return text
+        if kind == 'word' and text == 'NOT':
+            return 'NOT ' + self.parse_operator()
+        if kind == 'word' and text.upper() in OPERATOR_WORDS:
+            return text
+        raise MalformatedExpression(self.pattern)
+
+
+def parse_pattern(pattern):
+    """Parse a stix pattern
+
+    Args:
+        pattern (str): the stix pattern
+
+    Raises:
+        MalformatedExpression: if the pattern is malformated
+
+    Returns:
+        the root node of the AST
+    """
+    return Parser(pattern).parse()
+
+
+def comparisons(node):
+    """List the comparisons of an AST, in pattern order
+
+    Args:
+        node: the root node
+
+    Returns:
+        list: the Comparison nodes
+    """
+    result = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Comparison):
+            result.append(node)
+        elif isinstance(node, Group):
+            stack.append(node.operand)
+        else:
+            stack.extend(reversed(node.operands))
+    return result
+
+
+def _operand_aql(node, bind_vars):
+    # stix modifiers return expressions with their own operators
+    if isinstance(node, Comparison):
+        aql = node.modifier_aql()
+        if aql is not None:
+            return '(' + aql + ')'
+        return node.to_aql(bind_vars)
+    return _node_aql(node, bind_vars)
+
+
+def _node_aql(node, bind_vars):
+    if isinstance(node, Group):
+        # redundant parenthesis are removed
+        while isinstance(node.operand, Group):
+            node = node.operand
+        if isinstance(node.operand, Comparison):
+            aql = node.operand.modifier_aql()
+            if aql is not None:
+                return '(' + aql + ')'
+        return '(' + _node_aql(node.operand, bind_vars) + ')'
+    if isinstance(node, Comparison):
+        return node.to_aql(bind_vars)
+    return (' ' + node.operator + ' ').join(
+        _operand_aql(operand, bind_vars) for operand in node.operands
+    )
+
+
+def pattern_type(node, pattern=''):
+    """Get the type of the objects requested by a pattern
+
+    Args:
+        node: the root node
+        pattern (str, optional): the pattern, for error messages. \
+            Defaults to ''.
+
+    Raises:
+        PatternAlreadyContainsType: when contains different types of SDOs
+
+    Returns:
+        str: the type
+    """
+    type = None
+    for comparison in comparisons(node):
+        if type and type != comparison.type:
+            raise PatternAlreadyContainsType(type, comparison.type)
+        type = comparison.type
+    if not type:
+        raise MalformatedExpression(pattern)
+    return type
+
+
+def to_aql(node, pattern='', bind_vars=None):
+    """Generate the AQL filter of a pattern, f being the document
+
+    Args:
+        node: the root node
+        pattern (str, optional): the pattern, for error messages. \
+            Defaults to ''.
+        bind_vars (dict, optional): if set, the compared values and the \
+            type are added to it and replaced by bind parameters, so the \
+            query text does not depend on the values. Defaults to None.
+
+    Returns:
+        str: the AQL expression
+    """
+    type = pattern_type(node, pattern)
+    if isinstance(node, BooleanExpression) and node.operator == 'OR':
+        aql = '(' + _node_aql(node, bind_vars) + ')'
+    else:
+        aql = _operand_aql(node, bind_vars)
+    if bind_vars is None:
+        return aql + ' AND f.type == "' + type + '"'
+    bind_vars['type'] = type
+    return aql + ' AND f.type == @type'
@@ -5,6 +5,7 @@ from typing import Dict
 
 from stix2arango.exceptions import InvalidObjectForOptimizer
 from stix2arango.utils import deep_dict_update
+from stix2arango.pattern import Comparison, literal_value
 
 import psycopg2
 from psycopg2.errors import DuplicateTable
@@ -41,6 +42,41 @@ def convert_type(type_, value_):
     raise RuntimeError("%s type not found" % (type_))
 
 
+def delete_field_in_object(field, object):
+    """Remove the field stored by an optimizer from an object
+
+    The object is not modified : only the dicts on the path of the field \
+        are copied, other values are shared with the original object.
+
+    Args:
+        field (str): the optimized field (ex: ipv4-addr:value)
+        object (dict): the stix object
+
+    Returns:
+        dict: the object without the optimized field
+    """
+    object = dict(object)
+    object_type = field.split(':')[0]
+    field_path = field.split(':')[1:-1]
+    last_field = field.split(':')[-1]
+    if object['type'] == object_type:
+        dict_to_remove = object
+        for f in field_path:
+            if f in dict_to_remove:
+                dict_to_remove[f] = dict(dict_to_remove[f])
+                dict_to_remove = dict_to_remove[f]
+            else:
+                break
+        if last_field in dict_to_remove:
+            del dict_to_remove[last_field]
+    if field == 'ipv4-addr:x_ip':
+        if 'value' in object:
+            del object['value']
+    if 'id' in object:
+        del object['id']
+    return object
+
+
 class PGResult(dict):
     def __init__(
         self,
@@ -120,17 +156,15 @@ class PostgresOptimizer:
 
 
     def query(self, operator, value, feed):
-        if value[0] == '"' and value[-1] == '"':
-            value = "'" + value[1:-1] + "'"
         self.table_name = feed.storage_paradigm.get_collection_name(feed) + self.uuid
         if self.field == 'ipv4-addr:x_ip':
-            middle_sql = 'field0 >> ' + value
-            middle_sql += ' OR field0 = ' + value
+            middle_sql = 'field0 >> %s OR field0 = %s'
+            params = (literal_value(value),) * 2
         else:
-            middle_sql = 'field0 ' + operator_map[operator] + ' ' + value
+            middle_sql, params = Comparison(self.field, operator, value).to_sql('field0')
         sql = 'select arango_id, stix_id, field0 from ' + self.table_name + ' where ' + middle_sql + ';'
         with PostgresOptimizer.postgres_conn.cursor() as cursor:
-            cursor.execute(sql)
+            cursor.execute(sql, params)
             results = cursor.fetchall()
         return self.present_results(results)
 
@@ -145,9 +179,9 @@ class PostgresOptimizer:
                 pass
             if r['type'] == self.field.split(':')[0] or\
                 (self.field == 'ipv4-addr:x_ip' and r['type'] == 'ipv4-addr'):
-                sql = 'select arango_id, stix_id, field0 from ' + self.table_name + ' where arango_id = \'' + r['_key'] + '\''
+                sql = 'select arango_id, stix_id, field0 from ' + self.table_name + ' where arango_id = %s'
                 cursor = PostgresOptimizer.postgres_conn.cursor()
-                cursor.execute(sql)
+                cursor.execute(sql, (r['_key'],))
                 pg_results += cursor.fetchall()
         pg_results = self.present_results(pg_results)
         cross = []
@@ -160,9 +194,12 @@ class PostgresOptimizer:
 
 
     def crosses_results_with_arango(self, results, arango_conn, col_name) -> list:
-        aql2 = 'for el in %s filter el._key in %s return el' % (col_name, str(list(results.keys())))
+        aql2 = 'for el in @@collection filter el._key in @keys return el'
         aql_results = [result.getStore() for result in 
-                       arango_conn.AQLQuery(aql2, raw_results=True)]
+                       arango_conn.AQLQuery(aql2, raw_results=True, bindVars={
+                           '@collection': col_name,
+                           'keys': list(results.keys())
+                       })]
         matched_results = []
         for m in aql_results:
             obj = copy.deepcopy(m)
@@ -192,7 +229,7 @@ class PostgresOptimizer:
         }
 
     def __extract_field_type(self, field, stix_object):
-        object = copy.deepcopy(stix_object)
+        object = stix_object
         if field.split(':')[0] == object['type']:
             for f in field.split(':')[1:]:
                 try:
@@ -205,7 +242,7 @@ class PostgresOptimizer:
 
 
     def __extract_field_value(self, field, stix_object):
-        object = copy.deepcopy(stix_object)
+        object = stix_object
         if field.split(':')[0] == object['type']:
             for f in field.split(':')[1:]:
                 try:
@@ -224,7 +261,7 @@ class PostgresOptimizer:
                 type_ = convert_type(type_, value)
             else:
                 type_ = 'inet'
-            content = 'field0 ' + type_ + ', arango_id int, stix_id text'
+            content = 'field0 ' + type_ + ', arango_id bigint, stix_id text'
             self.table_name = feed.storage_paradigm.get_collection_name(feed) + self.uuid
             cursor = PostgresOptimizer.postgres_conn.cursor()
             base_query = 'create table ' + self.table_name + ' (%s);'
@@ -237,7 +274,8 @@ class PostgresOptimizer:
             pass
         self.table_created = True
 
-    def list_all_table(self):
+    @staticmethod
+    def list_all_table():
         s = "SELECT"
         s += " table_schema"
         s += ", table_name"
@@ -266,26 +304,20 @@ class PostgresOptimizer:
             return False
     
 
+    def drop_feed_table(self, feed):
+        """Drop the table of this optimizer for a feed generation
+
+        Args:
+            feed (stix2arango.feed.Feed): the feed generation
+        """
+        table_name = feed.storage_paradigm.get_collection_name(feed) + self.uuid
+        with PostgresOptimizer.postgres_conn.cursor() as cursor:
+            cursor.execute('drop table if exists ' + table_name)
+        PostgresOptimizer.postgres_conn.commit()
+        self.table_created = False
+
     def delete_fields_in_object(self, object):
-        object = copy.deepcopy(object)
-        object_type = self.field.split(':')[0]
-        field_path = self.field.split(':')[1:-1]
-        last_field = self.field.split(':')[-1]
-        if object['type'] == object_type:
-            dict_to_remove = object
-            for f in field_path:
-                if f in dict_to_remove:
-                    dict_to_remove = dict_to_remove[f]
-                else:
-                    break
-            if last_field in dict_to_remove:
-                del dict_to_remove[last_field]
-        if self.field == 'ipv4-addr:x_ip':
-            if 'value' in object:
-                del object['value']
-        if 'id' in object:
-            del object['id']
-        return object
+        return delete_field_in_object(self.field, object)
 
     @staticmethod
     def connect_db():
@@ -1,212 +1,167 @@
+from collections import namedtuple
 from platform import machine
 from re import match
-from threading import Thread
+from threading import Event
+from concurrent.futures import CancelledError, ThreadPoolExecutor, wait
+import logging
+import time
 
 from pyArango.query import AQLQuery
+from pyArango.theExceptions import AQLQueryError
 
 from stix2arango.feed import Feed
-from stix2arango.exceptions import (
-    PatternAlreadyContainsType,
-    MalformatedExpression,
-    FieldCanNotBeCalculatedBy)
-from stix2arango import stix_modifiers
-from stix2arango.utils import (
-    remove_redondant_parenthesis,
-    check_if_expression_is_balanced,
-    remove_unused_space,
-    merge_obj_list)
+from stix2arango.cache import LRUCache, ensure_index
+from stix2arango.pattern import (
+    tokenize,
+    parse_pattern,
+    comparisons,
+    pattern_type,
+    to_aql)
+from stix2arango.utils import merge_obj_list
 import uuid
 
-SPECIAL_CHARS = '[()]=<>'
-STRING_CHARS = '"\''
-SEPARATOR_CHARS = ' \t'
+# number of compiled patterns kept in memory
+PATTERN_CACHE_SIZE = 4096
+
+# everything the requests need from a stix pattern, bind_aql is the
+# filter with its values replaced by the bind_vars parameters
+CompiledPattern = namedtuple(
+    'CompiledPattern',
+    ['aql', 'type', 'fields', 'operators', 'values', 'bind_aql', 'bind_vars']
+)
+compiled_patterns = LRUCache(PATTERN_CACHE_SIZE)
+# number of feed collections requested by a single AQL query
+MULTI_FEED_QUERY_SIZE = 100
+# number of objects whose neighbours are fetched by a single traversal query
+GRAPH_BATCH_SIZE = 1000
+# number of threads shared by all the requests to run the feed queries
+REQUEST_WORKERS = 16
+# arangodb error of a query killed, by maxRuntime here
+ERROR_QUERY_KILLED = 1500
+
+logger = logging.getLogger(__name__)
+
+request_pool = ThreadPoolExecutor(
+    REQUEST_WORKERS,
+    thread_name_prefix='stix2arango_request'
+)
 
 
-def splitter(expression):
-    """Split a string into a list of words depending on the separator chars
+def pattern_compil(
+    expression,
+    return_type=False,
+    operator_list=None,
+    value_list=None,
+    field_list=None
+    ):
+    """Compile a stix pattern to AQL comparaison expression
 
     Args:
-        expression (str): the stix expression to split
+        expression (str): stix pattern to compile
+        return_type (bool) : return_type of requested object
+        operator_list (list): an object to save used operator, default to None
+
+    Raises:
+        PatternAlreadyContainsType: when contains different types of SDOs
 
     Returns:
-        list: the list of words
+        str: AQL expression or type of requested object is return_type is True
     """
-    is_in_string = False
-    string_opener = ''
-    result = []
-    current_word = ''
-    for c in expression:
-        if c in STRING_CHARS:
-            if not is_in_string:
-                is_in_string = True
-                string_opener = c
-            elif c == string_opener:
-                is_in_string = False
-        if c in SPECIAL_CHARS and not is_in_string:
-            if len(current_word) > 0:
-                result.append(current_word)
-            result.append(c)
-            current_word = ''
-        elif c not in SEPARATOR_CHARS or is_in_string:
-            current_word += c
-        elif c in SEPARATOR_CHARS and not is_in_string:
-            if len(current_word) > 0:
-                result.append(current_word)
-                current_word = ''
-    if len(current_word) > 0:
-        result.append(current_word)
-    return result
-
-
-def word_compil(word):
-    """Compile word in AQL syntax
+    aql_expression, type = _compil(
+        expression,
+        operator_list=operator_list,
+        value_list=value_list,
+        field_list=field_list
+    )
+    if return_type:
+        return type
+    else:
+        return aql_expression
 
-    Args:
-        word (str): the word to compile
 
-    Returns:
-        str: the word compiled
-    """
-    if len(word) == 0:
-        return word, None
-    if word == '[':
-        return '(', None
-    if word == ']':
-        return ')', None
-    if word[0] == '"' or word[0] == "'":
-        return word, None
-    if ':' in word:
-        splitted = word.split(':')
-        type = splitted[0]
-        for sep in SEPARATOR_CHARS:
-            type = type.replace(sep, '')
-        return word, type
-    return word, None
-
-
-def compare_compile(
-    compare_string,
-    operator_list=None,
-    value_list=None,
-    field_list=None):
-    """Compile a comparaison expression from stix to AQL
+def _compil(expression, operator_list=None, value_list=None, field_list=None):
+    tree = parse_pattern(expression)
+    for comparison in comparisons(tree):
+        if operator_list != None:
+            operator_list.append(comparison.operator)
+        if field_list != None:
+            field_list.append(comparison.field)
+        if value_list != None:
+            value_list.append(comparison.value)
+    return to_aql(tree, expression), pattern_type(tree, expression)
+
+
+def normalize_pattern(pattern):
+    """Collapse the separators outside of strings of a stix pattern
 
     Args:
-        compare_string (str): stix expression to compile
-        operator_list (list): an object to save used operator
+        pattern (str): the stix pattern
 
     Raises:
-        MalformatedExpression: if the expression is malformated
+        MalformatedExpression: on an unterminated string
 
     Returns:
-        str: AQL expression
+        str: the pattern, with single spaces between tokens
     """
-    splitted_compare = splitter(compare_string)
-    if len(splitted_compare) == 3:
-        operator = splitted_compare[1]
-    elif len(splitted_compare) == 4:
-        operator = splitted_compare[1] + splitted_compare[2]
-    else:
-        raise MalformatedExpression(compare_string)
-    if ':' in splitted_compare[0] and \
-            splitted_compare[0][0] not in STRING_CHARS:
-        field = splitted_compare[0]
-        value = splitted_compare[-1]
-    else:
-        field = splitted_compare[-1]
-        value = splitted_compare[0]
-    stix_type = field.split(':')[0]
-    if operator_list != None:
-        operator_list.append(operator)
-    if field_list != None:
-        field_list.append(field)
-    if value_list != None:
-        value_list.append(value)
-    try:
-        return stix_modifiers[stix_type].eval(field, operator, value)
-    except (FieldCanNotBeCalculatedBy, KeyError):
-        field = 'f.' + '.'.join(field.split(':')[1:])
-        if operator == '=':
-            operator = '=='
-        return field + ' ' + operator + ' ' + value
+    return ' '.join(text for _, text in tokenize(pattern))
 
 
-def pattern_compil(
-    expression,
-    return_type=False,
-    operator_list=None,
-    value_list=None,
-    field_list=None
-    ):
-    """Compile a stix pattern to AQL comparaison expression
+def compile_pattern(pattern):
+    """Compile a stix pattern, compiled patterns are kept in a LRU cache
 
     Args:
-        expression (str): stix pattern to compile
-        return_type (bool) : return_type of requested object
-        operator_list (list): an object to save used operator, default to None
+        pattern (str): stix pattern to compile
 
     Raises:
+        MalformatedExpression: if the expression is malformated
         PatternAlreadyContainsType: when contains different types of SDOs
 
     Returns:
-        str: AQL expression or type of requested object is return_type is True
+        CompiledPattern: AQL expression, type of requested object, \
+            compared fields, operators and values, parameterized AQL \
+            expression and its bind variables. The bind variables are \
+            shared by the cache, copy them before adding to them.
     """
-    if not(check_if_expression_is_balanced(expression)):
-        raise MalformatedExpression(expression)
-    current_word = ''
-    is_in_string = False
-    string_opener = ''
-    result = ''
-    current_compare = ''
-    l_compare = []
-    type = None
-    for c in expression:
-        if c in STRING_CHARS:
-            if not is_in_string:
-                is_in_string = True
-                string_opener = c
-            elif c == string_opener:
-                is_in_string = False
-        if (c not in SPECIAL_CHARS and c not in SEPARATOR_CHARS) \
-                or is_in_string:
-            current_word += c
-        if c in SPECIAL_CHARS + SEPARATOR_CHARS and not is_in_string:
-            word, calculated_type = word_compil(current_word)
-            result += word
-            word, _ = word_compil(c)
-            result += word
-            if current_word in ['(', ')', '[', ']', 'AND', 'OR']:
-                l_compare.append(current_compare)
-                current_compare = ''
-            else:
-                current_compare += current_word
-            if c not in ['(', ')', '[', ']'] and not is_in_string:
-                current_compare += c
-            current_word = ''
-            if calculated_type:
-                if type and type != calculated_type:
-                    raise PatternAlreadyContainsType(type, calculated_type)
-                type = calculated_type
-    result += current_word
-    l_compare.append(current_compare)
-    l_compare_compiled = [compare_compile(c, operator_list=operator_list, value_list=value_list, field_list=field_list) for c in l_compare]
-    for compare, compiled_compare in zip(l_compare, l_compare_compiled):
-        # ! quick fix : remove space before and after
-        while len(compare) > 0 and compare[0] in SEPARATOR_CHARS:
-            compare = compare[1:]
-        while len(compare) > 0 and compare[-1] in SEPARATOR_CHARS:
-            compare = compare[:-1]
-        result = result.replace(compare, compiled_compare)
-    if not type:
-        raise MalformatedExpression(expression)
-    aql_expression = result + ' AND f.type == "' + type + '"'
-    if return_type:
-        return type
-    else:
-        return remove_unused_space(remove_redondant_parenthesis(aql_expression))
+    key = normalize_pattern(pattern)
+    compiled = compiled_patterns.get(key)
+    if compiled is None:
+        tree = parse_pattern(key)
+        l_compare = comparisons(tree)
+        bind_vars = {}
+        bind_aql = to_aql(tree, key, bind_vars=bind_vars)
+        compiled = CompiledPattern(
+            to_aql(tree, key),
+            bind_vars['type'],
+            tuple(c.field for c in l_compare),
+            tuple(c.operator for c in l_compare),
+            tuple(c.value for c in l_compare),
+            bind_aql,
+            bind_vars
+        )
+        compiled_patterns.put(key, compiled)
+    return compiled
+
 
+def pattern_cache_info():
+    """Get the statistics of the compiled patterns cache
+
+    Returns:
+        dict: hits, misses, hit_rate, size and capacity of the cache
+    """
+    return compiled_patterns.info()
+
+
+def _max_runtime(deadline):
+    # seconds left before a time.monotonic deadline, for arangodb maxRuntime
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.001)
+
+
+class ThreadedRequestFeed:
+    """Request of a feed run in the shared request pool, with the \
+        start/join interface of a thread"""
 
-class ThreadedRequestFeed(Thread):
     def __init__(
         self, 
         request, 
@@ -215,7 +170,6 @@ class ThreadedRequestFeed(Thread):
         max_depth=1,
         create_index=True,
         limit=-1):
-        Thread.__init__(self)
         self.request = request
         self.feed = feed
         self.pattern = pattern
@@ -223,6 +177,7 @@ class ThreadedRequestFeed(Thread):
         self.create_index = create_index
         self.limit = limit
         self.results = []
+        self.future = None
 
     def run(self):
         self.results = self.request.request_one_feed(
@@ -233,18 +188,34 @@ class ThreadedRequestFeed(Thread):
             limit = self.limit,
         )
 
+    def start(self):
+        self.future = request_pool.submit(self.run)
+
+    def join(self, timeout=None):
+        wait([self.future], timeout=timeout)
+
+    def is_alive(self):
+        return self.future is not None and not self.future.done()
+
 class Request:
     """Class to manage a request to the database"""
 
-    def __init__(self, db_conn, date):
+    def __init__(self, db_conn, date, timeout=None):
         """Initialize the request
 
         Args:
             db_conn (pyArango database): the database connection
             date (datetime): timestamp of request
+            timeout (float, optional): seconds given to the feed queries \
+                of a request, the feeds not answered in time are listed \
+                in timed_out_feeds. Defaults to None, no deadline. The \
+                feeds whose query failed are listed in failed_feeds.
         """
         self.db_conn = db_conn
         self.date = date
+        self.timeout = timeout
+        self.timed_out_feeds = []
+        self.failed_feeds = []
 
     def __remove_arango_fields(self, object: dict) -> dict:
         """Remove the fields created by arangoDB from the object
@@ -264,7 +235,9 @@ class Request:
             pattern,
             max_depth=1,
             create_index=True,
-            limit=-1
+            limit=-1,
+            deadline=None,
+            cancelled=None
             ):
         """Request the objects from a feed
 
@@ -278,6 +251,11 @@ class Request:
             limit (int, optional): limit the number of results.
                 if set to -1, no limit.
                 Defaults to -1.
+            deadline (float, optional): time.monotonic deadline, the \
+                queries are killed by arangodb once reached. \
+                Defaults to None.
+            cancelled (threading.Event, optional): skips the graph \
+                traversal once set. Defaults to None.
 
         Returns:
             list: objects matching pattern and their related(depth limited)
@@ -285,16 +263,19 @@ class Request:
         # * we build aql query
         
         col_name = feed.storage_paradigm.get_collection_name(feed)
-        aql_prefix = 'FOR f IN {}  '.format(col_name)
+        compiled = compile_pattern(pattern)
+        operator_list = compiled.operators
+        value_list = compiled.values
+        field_list = compiled.fields
+        # the values are bound, the query text only depends on the
+        # pattern shape so arangodb can reuse its parsing
+        bind_vars = dict(compiled.bind_vars)
+        bind_vars['@collection'] = col_name
+        aql = 'FOR f IN @@collection FILTER ' + compiled.bind_aql
         if limit != -1:
-            aql_suffix = ' LIMIT %d RETURN f' % (limit)
-        else:
-            aql_suffix = ' RETURN f'
-        operator_list = []
-        value_list = []
-        field_list = []
-        aql_middle = 'FILTER ' + pattern_compil(pattern, operator_list=operator_list, value_list=value_list, field_list=field_list)
-        aql = aql_prefix + aql_middle + aql_suffix
+            aql += ' LIMIT @limit'
+            bind_vars['limit'] = limit
+        aql += ' RETURN f'
         # * we check if an optimizer can do the job
         matched_results = None
         for optimizer in feed.optimizers:
@@ -308,20 +289,63 @@ class Request:
                     self.db_conn, 
                     col_name)
         if matched_results == None:
+            options = {}
+            if deadline is not None:
+                options['maxRuntime'] = _max_runtime(deadline)
             matched_results = [e.getStore() for e in\
-                    self.db_conn.AQLQuery(aql, raw_results=True)]
+                    self.db_conn.AQLQuery(
+                        aql,
+                        raw_results=True,
+                        bindVars=bind_vars,
+                        options=options
+                    )]
 
         if create_index :
             if operator_list.count('=') == len(operator_list):
-                self._create_index_from_query(col_name, aql)
-        # create
+                self._create_index_from_query(col_name, aql, bind_vars)
+        return self._expand_results(
+            matched_results,
+            feed,
+            max_depth,
+            deadline=deadline,
+            cancelled=cancelled
+        )
+
+    def _expand_results(
+            self,
+            matched_results,
+            feed,
+            max_depth=1,
+            deadline=None,
+            cancelled=None):
+        """Add the related objects to the matched objects of a feed, \
+            and tag them with the feed
+
+        Args:
+            matched_results (list): the objects matching the pattern
+            feed (stix2arango.feed.Feed): the feed they come from
+            max_depth (int, optional): graph traversal depth limit. \
+                Defaults to 1.
+            deadline (float, optional): time.monotonic deadline of the \
+                graph traversal. Defaults to None.
+            cancelled (threading.Event, optional): skips the graph \
+                traversal once set. Defaults to None.
+
+        Returns:
+            list: objects matching pattern and their related(depth limited)
+        """
+        neighbours = {}
+        if max_depth > 0 and not (cancelled is not None and cancelled.is_set()):
+            neighbours = self._batch_graph_traversal(
+                [r['_id'] for r in matched_results],
+                feed,
+                max_depth=max_depth,
+                max_runtime=_max_runtime(deadline)
+            )
         results = []
         for r in matched_results:
             results.append(r)
-            if max_depth > 0:
-                vertexes = self._graph_traversal(r['_id'], feed, max_depth=max_depth)
-                for vertex in vertexes:
-                    results.append(vertex)
+            results += neighbours.get(r['_id'], [])
         i = 0
         while i < len(results):
             results[i] = self.__remove_arango_fields(results[i])
@@ -330,6 +354,195 @@ class Request:
             i += 1
         return results
 
+    def request_feeds(
+            self,
+            feeds,
+            pattern,
+            max_depth=1,
+            create_index=True,
+            limit=-1
+            ):
+        """Request the objects from several feeds in a single AQL query
+
+        Each feed collection is requested by a subquery of the same \
+            query, so the number of round trips does not grow with the \
+            number of feeds. Feeds with optimizers are requested one \
+            by one, feeds without collection are skipped.
+
+        Args:
+            feeds (list): the stix2arango.feed.Feed to request
+            pattern (str): the stix2.1 pattern
+            max_depth (int, optional): graph traversal depth limit.\
+                Defaults to 1.
+            create_index (bool, optional): create index based on search.\
+                Defaults to True.
+            limit (int, optional): limit the number of results per feed.
+                if set to -1, no limit.
+                Defaults to -1.
+
+        Returns:
+            list: objects matching pattern and their related(depth limited)
+        """
+        deadline = self._deadline()
+        compiled = compile_pattern(pattern)
+        tasks = []
+        l_feeds = []
+        cancelled = Event()
+        for feed in feeds:
+            if len(feed.optimizers) > 0:
+                tasks.append(([feed], self.request_one_feed, (
+                    feed,
+                    pattern,
+                    max_depth,
+                    create_index,
+                    limit,
+                    deadline,
+                    cancelled
+                )))
+            else:
+                l_feeds.append(feed)
+        if l_feeds:
+            # a missing collection (empty insertion, static feed being
+            # reloaded) would fail the query of the whole chunk
+            self.db_conn.reload()
+            l_feeds = [feed for feed in l_feeds if self.db_conn.hasCollection(
+                feed.storage_paradigm.get_collection_name(feed))]
+        if l_feeds:
+            col_names = [feed.storage_paradigm.get_collection_name(feed)
+                for feed in l_feeds]
+            if create_index and \
+                    compiled.operators.count('=') == len(compiled.operators):
+                self._create_index_from_pattern(col_names, compiled)
+        for i in range(0, len(l_feeds), MULTI_FEED_QUERY_SIZE):
+            chunk = l_feeds[i:i + MULTI_FEED_QUERY_SIZE]
+            tasks.append((chunk, self._request_chunk, (
+                chunk,
+                col_names[i:i + MULTI_FEED_QUERY_SIZE],
+                compiled,
+                max_depth,
+                limit,
+                deadline,
+                cancelled
+            )))
+        return self._gather(tasks, deadline, cancelled)
+
+    def _deadline(self):
+        self.timed_out_feeds = []
+        self.failed_feeds = []
+        if self.timeout is None:
+            return None
+        return time.monotonic() + self.timeout
+
+    def _gather(self, tasks, deadline=None, cancelled=None):
+        """Run tasks in the shared request pool until the deadline
+
+        Args:
+            tasks (list): (feeds, function, args) tuples, the function \
+                returns the results of the feeds
+            deadline (float, optional): time.monotonic deadline. \
+                Defaults to None.
+            cancelled (threading.Event, optional): set when the deadline \
+                is reached, for the running tasks to stop. Defaults to None.
+
+        Returns:
+            list: the results of the tasks done in time, the feeds of \
+                the other ones are added to timed_out_feeds and the \
+                feeds of the tasks raising an error to failed_feeds
+        """
+        futures = [request_pool.submit(function, *args)
+            for _, function, args in tasks]
+        timeout = None
+        if deadline is not None:
+            timeout = max(deadline - time.monotonic(), 0)
+        done, _ = wait(futures, timeout=timeout)
+        results = []
+        for (feeds, _, _), future in zip(tasks, futures):
+            names = [feed.feed_name for feed in feeds]
+            if future not in done:
+                future.cancel()
+                self.timed_out_feeds += names
+                continue
+            try:
+                results += future.result()
+            except CancelledError:
+                self.timed_out_feeds += names
+            except AQLQueryError as e:
+                if e.errors.get('errorNum') == ERROR_QUERY_KILLED:
+                    self.timed_out_feeds += names
+                else:
+                    logger.error('request of %s failed', names, exc_info=e)
+                    self.failed_feeds += names
+            except Exception as e:
+                # the other feeds are still returned
+                logger.error('request of %s failed', names, exc_info=e)
+                self.failed_feeds += names
+        if len(done) != len(futures) and cancelled is not None:
+            cancelled.set()
+        return results
+
+    def _request_chunk(
+            self,
+            feeds,
+            col_names,
+            compiled,
+            max_depth=1,
+            limit=-1,
+            deadline=None,
+            cancelled=None):
+        matched_results = self._query_collections(
+            col_names,
+            compiled,
+            limit,
+            max_runtime=_max_runtime(deadline)
+        )
+        results = []
+        for feed, matched in zip(feeds, matched_results):
+            results += self._expand_results(
+                matched,
+                feed,
+                max_depth,
+                deadline=deadline,
+                cancelled=cancelled
+            )
+        return results
+
+    def _query_collections(self, col_names, compiled, limit=-1, max_runtime=None):
+        """Run a compiled pattern on several collections in one query
+
+        Args:
+            col_names (list): the collections to request
+            compiled (CompiledPattern): the compiled pattern
+            limit (int, optional): limit the number of results per \
+                collection. if set to -1, no limit. Defaults to -1.
+            max_runtime (float, optional): seconds after which arangodb \
+                kills the query. Defaults to None.
+
+        Returns:
+            list: for each collection, the list of matching documents
+        """
+        bind_vars = dict(compiled.bind_vars)
+        suffix = ' RETURN f'
+        if limit != -1:
+            suffix = ' LIMIT @limit RETURN f'
+            bind_vars['limit'] = limit
+        subqueries = []
+        for i, col_name in enumerate(col_names):
+            bind_vars['@col%d' % i] = col_name
+            subqueries.append(
+                '(FOR f IN @@col%d FILTER %s%s)' % (i, compiled.bind_aql, suffix)
+            )
+        aql = 'FOR result IN [%s] RETURN result' % ', '.join(subqueries)
+        options = {}
+        if max_runtime is not None:
+            options['maxRuntime'] = max_runtime
+        return list(self.db_conn.AQLQuery(
+            aql,
+            rawResults=True,
+            batchSize=MULTI_FEED_QUERY_SIZE,
+            bindVars=bind_vars,
+            options=options
+        ))
+
     def request_one_feed_threaded(
             self,
             feed,
@@ -338,13 +551,14 @@ class Request:
             create_index=True,
             limit=-1
             ):
-        """Request objects from a feed using a thread
+        """Request objects from a feed in the shared request pool
 
         Args:
             Cf request_one_feed method
 
         Returns:
-            ThreadedRequestFeed: the thread in which request is launched
+            ThreadedRequestFeed: the started request, join it to get \
+                its results
         """
         thread = ThreadedRequestFeed(
             self,
@@ -362,7 +576,8 @@ class Request:
             pattern,
             tags=[],
             max_depth=1,
-            create_index=True
+            create_index=True,
+            single_query=True
             ):
         """Request the objects from the database
 
@@ -374,48 +589,87 @@ class Request:
                 Defaults to 1.
             create_index (bool, optional): create index based on search.\
                 Defaults to True.
+            single_query (bool, optional): request all the feeds in a \
+                single query, else one query per feed. Defaults to True.
         Returns:
             list: objects matching pattern and their related(depth limited)
         """
-        feeds = Feed.get_last_feeds(self.db_conn, self.date)
-        request_obj_type = pattern_compil(pattern, return_type=True)
-        feeds = [feed for feed in feeds if set(tags).issubset(set(feed.tags)) and \
-                (int(feed.version.split('.')[0]) == 0 or request_obj_type in feed.inserted_stix_types)]
-        results = []
-        l_threads = []
-        for feed in feeds:
-            threaded_request = self.request_one_feed_threaded(
-                feed,
+        request_obj_type = compile_pattern(pattern).type
+        feeds = Feed.get_last_feeds(
+            self.db_conn,
+            self.date,
+            tags=tags,
+            stix_type=request_obj_type
+        )
+        if single_query:
+            results = self.request_feeds(
+                feeds,
                 pattern,
                 max_depth=max_depth,
                 create_index=create_index
             )
-            l_threads.append(threaded_request)
-        for thread in l_threads:
-            thread.join()
-            results += thread.results
+            merge_obj_list(results)
+            return results
+        deadline = self._deadline()
+        cancelled = Event()
+        tasks = [([feed], self.request_one_feed, (
+            feed,
+            pattern,
+            max_depth,
+            create_index,
+            -1,
+            deadline,
+            cancelled
+        )) for feed in feeds]
+        results = self._gather(tasks, deadline, cancelled)
         merge_obj_list(results)
         return results
 
-    def _create_index_from_query(self, col_name, query):
+    def _create_index_from_query(self, col_name, query, bind_vars=None):
         """Create an index from a query
 
         Args:
             query (str): the query to create the index from
+            bind_vars (dict, optional): the bind variables of the query. \
+                Defaults to None.
 
         Returns:
             str: the created index
         """
         index_name = 'stix2arango_idx_' + str(uuid.uuid4())
-        fields = self._extract_field_from_query(query)
+        fields = self._extract_field_from_query(query, bind_vars)
         if len(fields):
-            self.db_conn[col_name].ensureIndex(
-                index_type='persistent',
-                fields=fields,
+            ensure_index(
+                self.db_conn,
+                col_name,
+                fields,
                 in_background=True
             )
         return index_name
 
+    def _create_index_from_pattern(self, col_names, compiled):
+        """Create the indexes used by a pattern on several collections, \
+            the query is explained once
+
+        Args:
+            col_names (list): the collections to index
+            compiled (CompiledPattern): the compiled pattern
+        """
+        bind_vars = dict(compiled.bind_vars)
+        bind_vars['@collection'] = col_names[0]
+        fields = self._extract_field_from_query(
+            'FOR f IN @@collection FILTER ' + compiled.bind_aql + ' RETURN f',
+            bind_vars
+        )
+        if len(fields):
+            for col_name in set(col_names):
+                ensure_index(
+                    self.db_conn,
+                    col_name,
+                    fields,
+                    in_background=True
+                )
+
     def _graph_traversal(self, id, feed, max_depth=1) -> dict:
         """Traverse the graph to get the related objects
 
@@ -427,20 +681,59 @@ class Request:
         Returns:
             list: the related objects
         """
-        col_name = id.split('/')[0]
-        aql = """FOR v, e, p in 1..2 ANY '{}' {} 
-                PRUNE COUNT(p.vertices) == 2 and p.vertices[1].type!="relationship"
-                RETURN v"""\
-            .format(id, 'edge_' + col_name, id)
-        matched_results = [result.getStore() for result in
-            self.db_conn.AQLQuery(aql, raw_results=True)]
-        results = []
-        if len(feed.optimizers) > 0:
-            for optimizer in feed.optimizers:
-                results += optimizer.query_from_arango_results(col_name, matched_results, self.db_conn)
-        else:
-            results = matched_results
-        return results
+        return self._batch_graph_traversal([id], feed, max_depth)[id]
+
+    def _batch_graph_traversal(self, ids, feed, max_depth=1, max_runtime=None) -> dict:
+        """Traverse the graph from several objects, with one query per \
+            GRAPH_BATCH_SIZE objects of a collection
+
+        Args:
+            ids (list): the ids of the objects to start the traversal
+            max_depth (int, optional): graph traversal depth limit. \
+                Defaults to 1.
+            max_runtime (float, optional): seconds after which arangodb \
+                kills the queries. Defaults to None.
+
+        Returns:
+            dict: the related objects of each id, without duplicates
+        """
+        aql = """FOR id IN @ids
+                LET vertexes = (
+                    FOR v, e, p in 1..2 ANY id @@edge_collection
+                    PRUNE COUNT(p.vertices) == 2 and p.vertices[1].type!="relationship"
+                    FILTER v != null
+                    RETURN DISTINCT v
+                )
+                RETURN {origin: id, vertexes: vertexes}"""
+        ids_by_col = {}
+        for id in ids:
+            ids_by_col.setdefault(id.split('/')[0], []).append(id)
+        options = {}
+        if max_runtime is not None:
+            options['maxRuntime'] = max_runtime
+        neighbours = {}
+        for col_name, col_ids in ids_by_col.items():
+            for i in range(0, len(col_ids), GRAPH_BATCH_SIZE):
+                traversals = self.db_conn.AQLQuery(
+                    aql,
+                    rawResults=True,
+                    batchSize=GRAPH_BATCH_SIZE,
+                    bindVars={
+                        'ids': col_ids[i:i + GRAPH_BATCH_SIZE],
+                        '@edge_collection': 'edge_' + col_name
+                    },
+                    options=options
+                )
+                for traversal in traversals:
+                    matched_results = traversal['vertexes']
+                    results = []
+                    if len(feed.optimizers) > 0:
+                        for optimizer in feed.optimizers:
+                            results += optimizer.query_from_arango_results(col_name, matched_results, self.db_conn)
+                    else:
+                        results = matched_results
+                    neighbours[traversal['origin']] = results
+        return neighbours
 
     def _extract_field_path(self, node):
         result = []
@@ -461,9 +754,9 @@ class Request:
                 results += self._extract_nodes(sub)
         return results
 
-    def _extract_field_from_query(self, aql):
-        query = self.db_conn.AQLQuery(aql)
-        explanation = query.explain()
+    def _extract_field_from_query(self, aql, bind_vars=None):
+        # explain only, the query is not run a second time
+        explanation = self.db_conn.explainAQLQuery(aql, bind_vars)
         fields = []
         for v in explanation['plan']['nodes']:
             if 'filter' in v:
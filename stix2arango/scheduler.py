@@ -0,0 +1,123 @@
+import time
+from threading import Event, Lock, Thread
+
+from stix2arango.feed import vaccum, VACCUM_WORKERS
+
+# default number of seconds between two scheduled vaccums
+DEFAULT_VACCUM_INTERVAL = 3600
+
+
+class VaccumScheduler(Thread):
+    """Run vaccum in a background thread, periodically or on demand.
+    """
+
+    def __init__(
+            self,
+            db_conn,
+            interval=DEFAULT_VACCUM_INTERVAL,
+            drops_per_second=None,
+            workers=VACCUM_WORKERS
+        ):
+        """Initialize the scheduler
+
+        Args:
+            db_conn (pyarango database): the database connection
+            interval (float, optional): seconds between two vaccums, \
+                vaccum only runs when triggered if None or 0. \
+                Defaults to DEFAULT_VACCUM_INTERVAL.
+            drops_per_second (float, optional): limit the rate of \
+                collection drops. Defaults to None.
+            workers (int, optional): number of collections dropped \
+                concurrently. Defaults to VACCUM_WORKERS.
+        """
+        super().__init__(daemon=True)
+        self.db_conn = db_conn
+        self.interval = interval or None
+        self.drops_per_second = drops_per_second
+        self.workers = workers
+        self.wakeup = Event()
+        self.stopped = Event()
+        self.lock = Lock()
+        self.running = False
+        self.runs = 0
+        self.progress = {'dropped': 0, 'total': 0}
+        self.started_at = None
+        self.next_run = None
+        self.last_report = None
+        self.last_error = None
+
+    def run(self):
+        while not self.stopped.is_set():
+            if self.interval:
+                self.next_run = time.time() + self.interval
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            if self.stopped.is_set():
+                break
+            self.run_once()
+
+    def run_once(self):
+        """Run a vaccum in the calling thread
+
+        Returns:
+            dict: the vaccum report, None if it failed
+        """
+        with self.lock:
+            self.running = True
+            self.started_at = time.time()
+            self.progress = {'dropped': 0, 'total': 0}
+        report = None
+        try:
+            report = vaccum(
+                self.db_conn,
+                workers=self.workers,
+                drops_per_second=self.drops_per_second,
+                progress=self.__on_progress
+            )
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+        with self.lock:
+            self.running = False
+            self.runs += 1
+            if report is not None:
+                self.last_report = report
+        return report
+
+    def __on_progress(self, dropped, total):
+        with self.lock:
+            self.progress = {'dropped': dropped, 'total': total}
+
+    def trigger(self):
+        """Ask for a vaccum as soon as possible
+
+        Returns:
+            bool: False if a vaccum is already running
+        """
+        if self.running:
+            return False
+        self.wakeup.set()
+        return True
+
+    def stop(self):
+        """Stop the scheduler, a running vaccum is completed"""
+        self.stopped.set()
+        self.wakeup.set()
+
+    def status(self):
+        """Get the state of the scheduler
+
+        Returns:
+            dict: running state, progress, number of runs, last report \
+                and error, next scheduled run
+        """
+        with self.lock:
+            return {
+                'running': self.running,
+                'progress': dict(self.progress),
+                'started_at': self.started_at,
+                'runs': self.runs,
+                'next_run': self.next_run,
+                'last_report': self.last_report,
+                'last_error': self.last_error
+            }
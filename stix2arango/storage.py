@@ -41,6 +41,10 @@ class Grouped(StorageParadigm):
 
 class Static(StorageParadigm):
     def get_collection_name(self, feed):
+        # feeds loaded by a shadow build have a collection per generation
+        generation = getattr(feed, 'generation', None)
+        if generation:
+            return feed.feed_name + '_static_' + str(generation)
         return feed.feed_name + '_static'
 
 
@@ -1,17 +1,36 @@
 from random import randint, Random
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+import hashlib
+import time
 import uuid
+import json
 import re
 import os
+from datetime import datetime
 
 from pyArango.connection import Connection
 from pyArango.theExceptions import CreationError
 from stix2 import parse
+from stix2.base import _STIXBase
+from stix2.utils import format_datetime
 
 from stix2arango.exceptions import MergeFailedException
 
 SPECIAL_CHARS = '[()]=<>'
 STRING_CHARS = '"\''
 SEPARATOR_CHARS = ' \t'
+JSON_SEPARATOR_CHARS = ' \t\r\n,'
+# size of the chunks read by iter_stix_file
+READ_CHUNK_SIZE = 1 << 20
+# start of the objects array of a bundle, whatever the order of its keys
+BUNDLE_OBJECTS = re.compile(r'"objects"\s*:\s*\[')
+# namespace of the ids computed by fast_update_uid_for_obj_list
+UID_NAMESPACE = uuid.UUID('6f0b3c8e-3f1a-5d2c-9e47-2a1d5b7c9e31')
+UID_EXCLUDED_FIELDS = ('created', 'modified', 'spec_version', 'id')
+# optional properties left out of the stix2 serialization when they
+# hold their default value
+STIX_OPTIONAL_DEFAULTS = {'revoked': False, 'defanged': False}
 
 
 def remove_redondant_parenthesis(expression):
@@ -100,6 +119,78 @@ def remove_unused_space(aql):
     return result
 
 
+def _canonical_value(value):
+    # values json can not encode, as the stix2 serialization writes them
+    if isinstance(value, datetime):
+        return format_datetime(value)
+    if isinstance(value, _STIXBase):
+        return json.loads(value.serialize())
+    return str(value)
+
+
+def canonical_fields(object):
+    """Get the fields of a stix object as they are in its serialization, \
+        so a stix2 object and its parsed JSON have the same fields
+
+    Args:
+        object (dict): the stix2 object or dict
+
+    Returns:
+        dict: the fields, the nested values are encoded by canonical_json
+    """
+    if isinstance(object, _STIXBase):
+        return json.loads(object.serialize())
+    return {k: v for k, v in object.items() \
+        if k not in STIX_OPTIONAL_DEFAULTS or v != STIX_OPTIONAL_DEFAULTS[k]}
+
+
+def canonical_json(fields):
+    """Serialize fields in a canonical form: sorted keys, no spaces and \
+        stix2 values written as in the stix2 serialization
+
+    Args:
+        fields (dict): the fields, from canonical_fields
+
+    Returns:
+        str: the serialization
+    """
+    return json.dumps(
+        fields,
+        sort_keys=True,
+        separators=(',', ':'),
+        default=_canonical_value
+    )
+
+
+def object_digest(object):
+    """Compute a fixed-size digest of the canonical serialization of \
+        an object
+
+    Args:
+        object (dict): the object to hash, a stix2 object or a dict
+
+    Returns:
+        bytes: a 16 bytes digest, equal for objects with the same content
+    """
+    canonical = canonical_json(canonical_fields(object))
+    return hashlib.blake2b(canonical.encode(), digest_size=16).digest()
+
+
+def stix_id_to_key(stix_id):
+    """Derive a deterministic arango _key from a stix id
+
+    The key is a 63 bits integer, as optimizers store keys as integers.
+
+    Args:
+        stix_id (str): the stix id
+
+    Returns:
+        str: the _key of the document storing the object
+    """
+    digest = hashlib.blake2b(stix_id.encode(), digest_size=8).digest()
+    return str(int.from_bytes(digest, 'big') >> 1)
+
+
 def update_id_for_sdo(sdo):
     """Update sdo id with a reproducible uuid base on fields
 
@@ -152,6 +243,63 @@ def update_uid_for_obj_list(l_obj):
     return [parse(obj) for obj in updated_l_obj]
 
 
+def deterministic_id(object):
+    """Compute a reproducible UUIDv5 id from the fields of an object
+
+    The same fields as update_id_for_sdo are ignored : references, custom \
+    x_ fields, id, created, modified and spec_version.
+
+    Args:
+        object (dict): the stix object, a stix2 object or a dict
+
+    Returns:
+        str: the stix id of the object
+    """
+    seed = {k:v for k,v in canonical_fields(object).items() \
+        if 'ref' not in k and k[:2] != 'x_' and k not in UID_EXCLUDED_FIELDS}
+    canonical = canonical_json(seed)
+    return object['type'] + '--' + str(uuid.uuid5(UID_NAMESPACE, canonical))
+
+
+def fast_update_uid_for_obj_list(l_obj, processes=None):
+    """Replace sdo id by deterministic id and replace id in relations and \
+        references, without parsing the objects again
+
+    Ids are not the ones computed by update_uid_for_obj_list.
+
+    Args:
+        l_obj (list): list of stix objects or dicts
+        processes (int, optional): compute ids in a pool of processes, \
+            for very large lists. Defaults to None.
+
+    Returns:
+        list: list of updated objects, as dicts
+    """
+    updated_l_obj = [dict(obj) for obj in l_obj]
+    sdos = [obj for obj in updated_l_obj if obj['type'] != 'relationship']
+    if processes:
+        with ProcessPoolExecutor(processes) as pool:
+            new_ids = list(pool.map(
+                deterministic_id,
+                sdos,
+                chunksize=max(1, len(sdos) // (processes * 4))
+            ))
+    else:
+        new_ids = [deterministic_id(sdo) for sdo in sdos]
+    id_transform = {}
+    for sdo, new_id in zip(sdos, new_ids):
+        id_transform[sdo['id']] = new_id
+        sdo['id'] = new_id
+    for obj in updated_l_obj:
+        for key, value in obj.items():
+            if key.endswith('ref'):
+                if value in id_transform:
+                    obj[key] = id_transform[value]
+            elif key.endswith('refs'):
+                obj[key] = [id_transform.get(v, v) for v in value]
+    return updated_l_obj
+
+
 
 def merge_obj(obj1, obj2):
     obj1 = dict(obj1)
@@ -181,6 +329,117 @@ def merge_obj_list(l_obj):
         i += 1
     return
 
+def iter_stix_file(path, chunk_size=READ_CHUNK_SIZE):
+    """Iterate over the objects of a stix bundle or of a JSONL file.
+
+    The file is read by chunks, so objects are parsed incrementally \
+        and the whole file is never loaded in memory.
+
+    Args:
+        path (str): path of the bundle (JSON) or JSONL file
+        chunk_size (int, optional): size of the chunks read from the file
+
+    Yields:
+        dict: stix objects
+    """
+    with open(path) as f:
+        head = f.readline(chunk_size)
+        if head.endswith('\n') or len(head) < chunk_size:
+            try:
+                first = json.loads(head)
+            except ValueError:
+                # multi-line JSON document : a pretty printed bundle
+                first = None
+        elif BUNDLE_OBJECTS.search(head):
+            # a bundle serialized on a single (long) line
+            first = None
+        else:
+            first = json.loads(head + f.readline())
+        if first is None:
+            yield from _iter_bundle_objects(f, head, chunk_size)
+        elif first.get('type') == 'bundle':
+            yield from first.get('objects', [])
+        else:
+            yield first
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _iter_bundle_objects(f, buffer, chunk_size):
+    """Iterate over the objects array of a bundle read by chunks
+
+    Args:
+        f (file): the bundle file, positioned after buffer
+        buffer (str): the beginning of the file already read
+        chunk_size (int): size of the chunks read from the file
+
+    Raises:
+        json.JSONDecodeError: if there is no objects array, so a corrupt \
+            file is not taken for an empty one
+
+    Yields:
+        dict: stix objects
+    """
+    decoder = json.JSONDecoder()
+    match = BUNDLE_OBJECTS.search(buffer)
+    while not match:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            raise json.JSONDecodeError('no objects array', buffer, len(buffer))
+        buffer += chunk
+        match = BUNDLE_OBJECTS.search(buffer)
+    pos = match.end()
+    while True:
+        while pos < len(buffer) and buffer[pos] in JSON_SEPARATOR_CHARS:
+            pos += 1
+        if pos == len(buffer):
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise json.JSONDecodeError('unterminated objects array', buffer, pos)
+            buffer, pos = chunk, 0
+            continue
+        if buffer[pos] == ']':
+            return
+        try:
+            obj, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # the object is split between two chunks
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        yield obj
+        pos = end
+
+
+class RateLimiter:
+    """Space the calls of wait() to a maximum rate, across threads."""
+
+    def __init__(self, rate=None):
+        """Initialize the limiter
+
+        Args:
+            rate (float, optional): maximum number of calls per second, \
+                unlimited when None. Defaults to None.
+        """
+        self.interval = 1 / rate if rate else 0
+        self.next_slot = 0
+        self.lock = Lock()
+
+    def wait(self):
+        """Block until the next call is allowed"""
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
 class ArangoUser:
     def __init__(self, name, password, arangoURL):
         self.id = randint(0, 1000000)
@@ -0,0 +1,87 @@
+import copy
+import sys
+import time
+
+sys.path.insert(0, '/app')
+sys.path.insert(0, '.')
+
+from stix2 import File, IPv4Address, AutonomousSystem
+
+from stix2arango import stix_modifiers
+from stix2arango.feed import prepare_object
+from stix2arango.utils import object_digest
+
+
+OPTIMIZER_FIELDS = ['ipv4-addr:value', 'file:hashes:MD5']
+
+
+def legacy_delete_field_in_object(field, object):
+    # copy of the field removal done before prepare_object
+    object = copy.deepcopy(object)
+    object_type = field.split(':')[0]
+    field_path = field.split(':')[1:-1]
+    last_field = field.split(':')[-1]
+    if object['type'] == object_type:
+        dict_to_remove = object
+        for f in field_path:
+            if f in dict_to_remove:
+                dict_to_remove = dict_to_remove[f]
+            else:
+                break
+        if last_field in dict_to_remove:
+            del dict_to_remove[last_field]
+    if 'id' in object:
+        del object['id']
+    return object
+
+
+def legacy_prepare_object(object, optimizer_fields=[]):
+    # copy of the conversion done before prepare_object
+    object = dict(object)
+    object_save = copy.deepcopy(object)
+    if len(optimizer_fields) > 0:
+        for field in optimizer_fields:
+            object = legacy_delete_field_in_object(field, object)
+    elif object['type'] in stix_modifiers:
+        args = dict(object)
+        object = dict(stix_modifiers[object['type']](**args))
+    edges = []
+    for key in object_save:
+        suffix = key.split('_')[-1]
+        if suffix == 'ref':
+            edges.append((object_save['id'], object_save[key], key))
+        elif suffix == 'refs':
+            for ref in object_save[key]:
+                edges.append((object_save['id'], ref, key))
+    return object, object_save, edges, object_digest(object)
+
+
+def gen_objects(N):
+    autonomous_system = AutonomousSystem(number=1234, name='Google')
+    objects = [autonomous_system]
+    for i in range(N):
+        objects.append(IPv4Address(
+            value='10.%d.%d.%d' % (i // 65536, (i // 256) % 256, i % 256),
+            belongs_to_refs=[autonomous_system.id]
+        ))
+        objects.append(File(name='file%d' % i, hashes={
+            'MD5': '%032x' % i,
+            'SHA-256': '%064x' % i
+        }))
+    return objects
+
+
+def bench(function, objects, optimizer_fields):
+    start = time.time()
+    for object in objects:
+        function(object, optimizer_fields)
+    return time.time() - start
+
+
+if __name__ == "__main__":
+    objects = gen_objects(20000)
+    for fields, name in [([], 'no optimizer'), (OPTIMIZER_FIELDS, 'optimizers')]:
+        legacy = bench(legacy_prepare_object, objects, fields)
+        current = bench(prepare_object, objects, fields)
+        print('With %s : %f secs with deep copies, %f secs without (%d objects)'
+            % (name, legacy, current, len(objects)))
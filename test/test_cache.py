@@ -0,0 +1,95 @@
+import unittest
+
+import sys
+sys.path.insert(0, '/app')
+
+from stix2arango.cache import (LRUCache, FeedCatalog, Timeline,
+                               ensure_collection, ensure_index,
+                               forget_collection, forget_collections)
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TestLRUCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = LRUCache(capacity=2)
+
+    def test_eviction(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.cache.put('c', 3)
+        self.assertEqual(len(self.cache), 2)
+        self.assertIn('a', self.cache)
+        self.assertNotIn('b', self.cache)
+
+    def test_counters(self):
+        self.cache.put('a', 1)
+        self.cache.get('a')
+        self.cache.get('b')
+        info = self.cache.info()
+        self.assertEqual(info['hits'], 1)
+        self.assertEqual(info['misses'], 1)
+        self.assertEqual(info['hit_rate'], 0.5)
+
+
+class TestTimeline(unittest.TestCase):
+    def setUp(self):
+        self.timeline = Timeline([(30, 'c'), (10, 'a'), (20, 'b')])
+
+    def test_before(self):
+        self.assertIsNone(self.timeline.before(10))
+        self.assertEqual(self.timeline.before(11), 'a')
+        self.assertEqual(self.timeline.before(20), 'a')
+        self.assertEqual(self.timeline.before(1000), 'c')
+        self.assertEqual(self.timeline.last(), 'c')
+
+
+class TestFeedCatalog(unittest.TestCase):
+    def setUp(self):
+        self.catalog = FeedCatalog()
+
+    def test_incremental_refresh(self):
+        self.assertIsNone(self.catalog.stale_feeds({'version': 2, 'feeds': {}}))
+        self.catalog.update(2, {'a': Timeline([(1, 'a')]), 'b': Timeline([(1, 'b')])})
+        catalog_version = {'version': 4, 'feeds': {'a': 1, 'b': 3, 'c': 4}}
+        self.assertEqual(self.catalog.stale_feeds(catalog_version), ['b', 'c'])
+        self.catalog.update(4, {'c': Timeline([(2, 'c')])}, ['b', 'c'])
+        self.assertEqual(sorted(self.catalog.timelines), ['a', 'c'])
+        self.assertEqual(self.catalog.info()['generations'], 2)
+
+    def test_reset(self):
+        self.catalog.update(2, {})
+        self.assertIsNone(self.catalog.stale_feeds({'version': 3, 'feeds': {}, 'reset': 3}))
+
+
+class TestKnownCollections(unittest.TestCase):
+    class Connection:
+        def __init__(self):
+            self.created = []
+
+        def createCollection(self, className='Collection', name=None):
+            self.created.append(name)
+
+        def __getitem__(self, name):
+            return self
+
+        def ensureIndex(self, **index_args):
+            pass
+
+    def test_forget_collections(self):
+        db_conn = self.Connection()
+        ensure_collection(db_conn, 'feed_grouped')
+        ensure_collection(db_conn, 'feed_grouped')
+        self.assertEqual(db_conn.created, ['feed_grouped'])
+        forget_collections(db_conn)
+        ensure_collection(db_conn, 'feed_grouped')
+        self.assertEqual(db_conn.created, ['feed_grouped', 'feed_grouped'])
+
+    def test_concurrent_forget(self):
+        db_conn = self.Connection()
+        for i in range(500):
+            ensure_index(db_conn, 'col_%d' % (i % 50), ['field_%d' % i])
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda i: forget_collection(db_conn, 'col_%d' % i), range(50)))
+            list(pool.map(lambda i: ensure_index(db_conn, 'other', ['f_%d' % i]), range(500)))
+        forget_collection(db_conn, 'other')
@@ -0,0 +1,26 @@
+import unittest
+
+import sys
+sys.path.insert(0, '/app')
+
+from stix2arango.garbage import COLLECTION_NAME, TABLE_NAME
+
+
+class TestOrphanNames(unittest.TestCase):
+    def test_collection_names(self):
+        for name in ['feed_1644336051', 'edge_feed_1644336051', 'my_feed_grouped', 'my_feed_static']:
+            self.assertIsNotNone(COLLECTION_NAME.match(name))
+        for name in ['meta_history', 'users', '_graphs']:
+            self.assertIsNone(COLLECTION_NAME.match(name))
+
+    def test_shadow_generation(self):
+        match = COLLECTION_NAME.match('my_feed_static_1644336051000')
+        self.assertEqual(match.group('generation'), '1644336051000')
+        self.assertIsNone(COLLECTION_NAME.match('my_feed_1644336051').group('generation'))
+        self.assertEqual(COLLECTION_NAME.match('my_feed_1644336051').group('timestamp'), '1644336051')
+        self.assertIsNone(COLLECTION_NAME.match('my_feed_static_1644336051000').group('timestamp'))
+
+    def test_table_names(self):
+        match = TABLE_NAME.match('feed_16443360515f0c8e1a_3f1a_4d2c_9e47_2a1d5b7c9e31')
+        self.assertEqual(match.group('collection'), 'feed_1644336051')
+        self.assertIsNone(TABLE_NAME.match('feed_1644336051'))
@@ -1,5 +1,6 @@
 # ensure that we use the current version of the package
 import unittest
+import time
 
 import sys
 sys.path.insert(0, '/app')
@@ -10,6 +11,8 @@ from stix2 import IPv4Address, AutonomousSystem, Identity
 from stix2 import Relationship, Incident, IPv6Address
 from pyArango.connection import *
 from stix2arango.feed import Feed, vaccum
+from stix2arango.scheduler import VaccumScheduler
+from stix2arango.garbage import collect_garbage
 from stix2arango.request import Request
 from stix2arango.storage import GROUPED, GROUPED_BY_MONTH, TIME_BASED, STATIC
 from stix2arango.utils import get_database
@@ -94,6 +97,43 @@ class GeneralTest(unittest.TestCase):
             if feed.feed_name == 'vaccumentest':
                 raise Exception('Vaccum failed')
 
+    def test_vaccum_scheduler(self):
+        feed = Feed(db_conn, 'scheduledvaccum', storage_paradigm=TIME_BASED, vaccum_date=datetime.fromtimestamp(10))
+        feed.insert_stix_object_in_arango([self.ipv4])
+        scheduler = VaccumScheduler(db_conn, interval=None, drops_per_second=10)
+        scheduler.start()
+        self.assertTrue(scheduler.trigger())
+        while scheduler.status()['runs'] == 0:
+            time.sleep(0.1)
+        scheduler.stop()
+        status = scheduler.status()
+        self.assertIsNone(status['last_error'])
+        self.assertGreaterEqual(status['last_report']['generations'], 1)
+
+    def test_collect_garbage(self):
+        db_conn.createCollection(name='orphanfeed_1000')
+        loading = 'loadingfeed_%d' % int(time.time())
+        db_conn.createCollection(name=loading)
+        report = collect_garbage(db_conn)
+        self.assertIn('orphanfeed_1000', report['collections'])
+        self.assertNotIn(loading, report['collections'])
+        self.assertTrue(db_conn.hasCollection('orphanfeed_1000'))
+        report = collect_garbage(db_conn, dry_run=False)
+        self.assertGreaterEqual(report['dropped_collections'], 1)
+        db_conn.reload()
+        self.assertFalse(db_conn.hasCollection('orphanfeed_1000'))
+        self.assertTrue(db_conn.hasCollection('meta_history'))
+
+    def test_vaccum_shared_collection(self):
+        feed = Feed(db_conn, 'vaccumgrouped', storage_paradigm=GROUPED, vaccum_date=datetime.fromtimestamp(10))
+        feed.insert_stix_object_in_arango([self.identity])
+        feed = Feed(db_conn, 'vaccumgrouped', storage_paradigm=GROUPED)
+        feed.insert_stix_object_in_arango([self.ipv4, self.autonomous_system])
+        report = vaccum(db_conn)
+        self.assertGreaterEqual(report['generations'], 1)
+        col_name = feed.storage_paradigm.get_collection_name(feed)
+        self.assertTrue(db_conn.hasCollection(col_name))
+
 
     def test_optimisation_patch(self):
         r = '[ipv4-addr:value = "mushroom" OR ipv4-addr:net != "red hot"]'
@@ -125,7 +165,152 @@ class GeneralTest(unittest.TestCase):
         feed.insert_stix_object_in_arango([self.identity, self.autonomous_system])
         self.assertEqual(db_conn[col_name].count(), 2)
 
+    def test_static_shadow_build(self):
+        feed = Feed(db_conn, 'shadowfeed', storage_paradigm=STATIC)
+        feed.insert_stix_object_in_arango([self.ipv4, self.autonomous_system])
+        old_col_name = feed.storage_paradigm.get_collection_name(feed)
+        feed = Feed(db_conn, 'shadowfeed', storage_paradigm=STATIC, shadow_build=True)
+        feed.insert_stix_object_in_arango([self.identity])
+        col_name = feed.storage_paradigm.get_collection_name(feed)
+        self.assertNotEqual(col_name, old_col_name)
+        self.assertFalse(db_conn.hasCollection(old_col_name))
+        self.assertEqual(db_conn[col_name].count(), 1)
+        feeds = [f for f in Feed.get_last_feeds(db_conn, datetime.now())
+            if f.feed_name == 'shadowfeed']
+        self.assertEqual(len(feeds), 1)
+        self.assertEqual(feeds[0].storage_paradigm.get_collection_name(feeds[0]), col_name)
+
+    def test_get_last_feeds_filters(self):
+        feed = Feed(db_conn, 'catalogfeed', tags=['catalog', 'grouped'], storage_paradigm=GROUPED)
+        feed.insert_stix_object_in_arango([self.identity])
+        names = [f.feed_name for f in Feed.get_last_feeds(
+            db_conn, datetime.now(), tags=['catalog'], stix_type='identity')]
+        self.assertEqual(names.count('catalogfeed'), 1)
+        names = [f.feed_name for f in Feed.get_last_feeds(
+            db_conn, datetime.now(), tags=['catalog'], stix_type='ipv4-addr')]
+        self.assertNotIn('catalogfeed', names)
+        names = [f.feed_name for f in Feed.get_last_feeds(
+            db_conn, datetime.now(), tags=['catalog', 'missing'])]
+        self.assertNotIn('catalogfeed', names)
+
+    def test_catalog_cache(self):
+        feeds = Feed.get_last_feeds(db_conn, datetime.now())
+        self.assertIs(Feed.get_last_feeds(db_conn, datetime.now())[0], feeds[0])
+        feed = Feed(db_conn, 'cataloggedfeed', storage_paradigm=GROUPED)
+        feed.insert_stix_object_in_arango([self.identity])
+        names = [f.feed_name for f in Feed.get_last_feeds(db_conn, datetime.now())]
+        self.assertIn('cataloggedfeed', names)
+        feed.drop()
+        names = [f.feed_name for f in Feed.get_last_feeds(db_conn, datetime.now())]
+        self.assertNotIn('cataloggedfeed', names)
+
+    def test_timeline_lookup(self):
+        date = datetime(2021, 6, 1)
+        for days in [0, 10, 20]:
+            feed = Feed(db_conn, 'timelinefeed', storage_paradigm=TIME_BASED, date=date + timedelta(days=days))
+            feed.insert_stix_object_in_arango([self.ipv4, self.autonomous_system])
+        feeds = [f for f in Feed.get_last_feeds(db_conn, date + timedelta(days=15))
+            if f.feed_name == 'timelinefeed']
+        self.assertEqual(feeds[0].date, date + timedelta(days=10))
+        feeds = [f for f in Feed.get_last_feeds(db_conn, date)
+            if f.feed_name == 'timelinefeed']
+        self.assertEqual(feeds, [])
+
+    def test_drop_all_generations(self):
+        date = datetime(2021, 1, 1)
+        col_names = []
+        for days in [0, 1]:
+            feed = Feed(db_conn, 'droppedfeed', storage_paradigm=TIME_BASED, date=date + timedelta(days=days))
+            feed.insert_stix_object_in_arango([self.ipv4])
+            col_names.append(feed.storage_paradigm.get_collection_name(feed))
+        feed.drop()
+        db_conn.reload()
+        for col_name in col_names:
+            self.assertFalse(db_conn.hasCollection(col_name))
+        names = [f.feed_name for f in Feed.get_last_feeds(db_conn, datetime.now())]
+        self.assertNotIn('droppedfeed', names)
+
     def test_grouped_search(self):
         request = Request(db_conn, datetime.now() - timedelta(days=1000))
         r = request.request("[identity:name = 'My grand mother']", tags=['grouped'])
-        self.assertGreater(len(r), 0)
\ No newline at end of file
+        self.assertGreater(len(r), 0)
+
+    def test_batched_insert(self):
+        feed = Feed(db_conn, 'batchfeed', tags=['batch'], storage_paradigm=TIME_BASED, batch_size=2)
+        identities = [Identity(name='batch %d' % i, identity_class='individual') for i in range(5)]
+        feed.insert_stix_object_in_arango(identities + [self.autonomous_system, self.ipv4])
+        col_name = feed.storage_paradigm.get_collection_name(feed)
+        self.assertEqual(db_conn[col_name].count(), 7)
+        self.assertEqual(db_conn['edge_' + col_name].count(), 1)
+        for identity in identities:
+            self.assertTrue(feed.obj_inserted[identity.id].startswith(col_name + '/'))
+        self.assertEqual(feed.insertion_stats['objects'], 7)
+        self.assertGreater(feed.objects_per_second, 0)
+
+    def test_duplicate_edges(self):
+        feed = Feed(db_conn, 'duplicateedges', tags=['batch'], storage_paradigm=TIME_BASED)
+        feed.insert_stix_object_in_arango([self.autonomous_system, self.ipv4, self.ipv4])
+        col_name = feed.storage_paradigm.get_collection_name(feed)
+        self.assertEqual(db_conn['edge_' + col_name].count(), 1)
+
+    def test_insert_stix_stream(self):
+        feed = Feed(db_conn, 'streamfeed', tags=['stream'], storage_paradigm=TIME_BASED, batch_size=2)
+        feed.insert_stix_stream(iter([self.ipv4, self.autonomous_system, self.identity, self.relation]))
+        col_name = feed.storage_paradigm.get_collection_name(feed)
+        self.assertEqual(db_conn[col_name].count(), 4)
+        self.assertEqual(db_conn['edge_' + col_name].count(), 3)
+
+    def test_parallel_insert(self):
+        feed = Feed(db_conn, 'parallelfeed', tags=['parallel'], storage_paradigm=TIME_BASED, batch_size=2)
+        identities = [Identity(name='parallel %d' % i, identity_class='individual') for i in range(10)]
+        feed.insert_stix_object_in_arango_parallel(
+            identities + [self.autonomous_system, self.ipv4, self.ipv6],
+            workers=2
+        )
+        col_name = feed.storage_paradigm.get_collection_name(feed)
+        self.assertEqual(db_conn[col_name].count(), 13)
+        self.assertEqual(db_conn['edge_' + col_name].count(), 2)
+
+    def test_delta_insert(self):
+        autonomous_system = AutonomousSystem(number=4321, name='Delta')
+        ipv4 = IPv4Address(value='97.8.9.9', belongs_to_refs=[self.autonomous_system.id])
+        feed = Feed(db_conn, 'deltafeed', tags=['delta'], storage_paradigm=GROUPED, delta=True)
+        feed.insert_stix_object_in_arango([self.autonomous_system, autonomous_system, ipv4])
+        col_name = feed.storage_paradigm.get_collection_name(feed)
+        count = db_conn[col_name].count()
+
+        changed_ipv4 = IPv4Address(id=ipv4.id, value='97.8.9.9', belongs_to_refs=[autonomous_system.id])
+        feed = Feed(db_conn, 'deltafeed', tags=['delta'], storage_paradigm=GROUPED, delta=True)
+        feed.insert_stix_object_in_arango([self.autonomous_system, autonomous_system, changed_ipv4])
+        self.assertEqual(feed.delta_stats, {'new': 0, 'changed': 1, 'unchanged': 2})
+        self.assertEqual(db_conn[col_name].count(), count)
+        edges = db_conn.AQLQuery(
+            'FOR e IN @@col FILTER e._from == @id RETURN e._to',
+            rawResults=True,
+            bindVars={'@col': 'edge_' + col_name, 'id': feed.obj_inserted[ipv4.id]}
+        )
+        self.assertEqual(list(edges), [feed.obj_inserted[autonomous_system.id]])
+
+    def test_deterministic_keys(self):
+        feed = Feed(db_conn, 'keyedfeed', tags=['keyed'], storage_paradigm=GROUPED, deterministic_keys=True)
+        feed.insert_stix_object_in_arango([self.autonomous_system, self.ipv4])
+        feed.insert_stix_object_in_arango([self.autonomous_system, self.ipv4])
+        col_name = feed.storage_paradigm.get_collection_name(feed)
+        doc = db_conn[feed.get_document_id(self.ipv4.id)]
+        self.assertEqual(doc['id'], self.ipv4.id)
+        self.assertEqual(db_conn[col_name].count(), 2)
+
+    def test_deterministic_keys_missing_object(self):
+        feed = Feed(db_conn, 'keyedmissingfeed', tags=['keyed'], storage_paradigm=GROUPED, deterministic_keys=True)
+        with self.assertRaises(KeyError):
+            feed.get_document_id(self.autonomous_system.id)
+        with self.assertRaises(RuntimeError):
+            feed.insert_stix_object_in_arango([self.ipv4])
+
+    def test_collection_cache_invalidation(self):
+        feed = Feed(db_conn, 'cachedfeed', tags=['cached'], storage_paradigm=GROUPED)
+        feed.insert_stix_object_in_arango([self.ipv4, self.autonomous_system])
+        feed.drop()
+        feed.insert_stix_object_in_arango([self.identity])
+        col_name = feed.storage_paradigm.get_collection_name(feed)
+        self.assertEqual(db_conn[col_name].count(), 1)
@@ -9,7 +9,7 @@ from pyArango.connection import *
 from pyArango.theExceptions import CreationError
 
 from stix2arango.feed import Feed, vaccum
-from stix2arango.request import Request, pattern_compil
+from stix2arango.request import Request, pattern_compil, compile_pattern, pattern_cache_info
 from stix2arango.storage import GROUPED, GROUPED_BY_MONTH, TIME_BASED
 from stix2arango import stix_modifiers
 from stix2arango.exceptions import (PatternAlreadyContainsType,
@@ -19,6 +19,64 @@ from stix2arango.utils import get_database
 from datetime import datetime
 
 
+class TestCompilePattern(unittest.TestCase):
+    def test_compiled_artifacts(self):
+        compiled = compile_pattern('[ipv4-addr:value = "mushroom" OR ipv4-addr:x_n > 1]')
+        self.assertEqual(compiled.type, 'ipv4-addr')
+        self.assertEqual(compiled.fields, ('ipv4-addr:value', 'ipv4-addr:x_n'))
+        self.assertEqual(compiled.operators, ('=', '>'))
+        self.assertEqual(compiled.values, ('"mushroom"', '1'))
+        self.assertEqual(compiled.aql, pattern_compil('[ipv4-addr:value = "mushroom" OR ipv4-addr:x_n > 1]'))
+
+    def test_cache_hit(self):
+        compiled = compile_pattern("[identity:name = 'cached']")
+        hits = pattern_cache_info()['hits']
+        self.assertIs(compile_pattern("  [identity:name   =  'cached']"), compiled)
+        self.assertEqual(pattern_cache_info()['hits'], hits + 1)
+        self.assertIsNot(compile_pattern("[identity:name = 'cached  ']"), compiled)
+
+    def test_bind_parameters(self):
+        first = compile_pattern("[ipv4-addr:value = '1.1.1.1' OR ipv4-addr:x_n > 2]")
+        second = compile_pattern('[ipv4-addr:value = "o\'clock" OR ipv4-addr:x_n > 2.5]')
+        self.assertEqual(first.bind_aql, second.bind_aql)
+        self.assertEqual(
+            first.bind_aql,
+            '(f.value == @v0 OR f.x_n > @v1) AND f.type == @type'
+        )
+        self.assertEqual(first.bind_vars, {'v0': '1.1.1.1', 'v1': 2, 'type': 'ipv4-addr'})
+        self.assertEqual(second.bind_vars['v0'], "o'clock")
+        self.assertEqual(second.bind_vars['v1'], 2.5)
+
+
+class TestPatternParser(unittest.TestCase):
+    def test_substring_values(self):
+        aql = pattern_compil('[ipv4-addr:x_n = 1 OR ipv4-addr:x_n = 10]')
+        self.assertEqual(aql, '(f.x_n == 1 OR f.x_n == 10) AND f.type == "ipv4-addr"')
+
+    def test_modifier_precedence(self):
+        aql = pattern_compil("[ipv4-addr:x_ip = '1.1.1.1' AND ipv4-addr:value = 'b']")
+        self.assertTrue(aql.startswith('((f.x_ip == 16843009'))
+        self.assertIn(") AND f.value == 'b')", aql)
+
+    def test_malformated(self):
+        for pattern in ["[ipv4-addr:value = 'a'", "[ipv4-addr:value = 'a]",
+                        "[ipv4-addr:value = 'a' AND]", "[ipv4-addr:value 'a']",
+                        "[file:name = f.name]", "[file:name = @type]",
+                        "[file:name = file:parent]", "[file:size > inf]"]:
+            with self.assertRaises(MalformatedExpression):
+                pattern_compil(pattern)
+
+    def test_large_or(self):
+        pattern = '[' + ' OR '.join(
+            "ipv4-addr:value = '10.0.%d.%d'" % (i // 256, i % 256) for i in range(500)
+        ) + ']'
+        operators = []
+        aql = pattern_compil(pattern, operator_list=operators)
+        self.assertEqual(len(operators), 500)
+        self.assertEqual(aql.count(' OR '), 499)
+        self.assertTrue(aql.endswith(') AND f.type == "ipv4-addr"'))
+
+
 class TestRequest(unittest.TestCase):
     def setUp(self):
         self.db_conn = get_database()
@@ -133,6 +191,69 @@ class TestRequest(unittest.TestCase):
         assert(len(results) == 0)
         print('OK')
 
+    def test_request_feeds(self):
+        print('\n\n> Single query on several feeds')
+        feeds = []
+        for i in range(3):
+            feed = Feed(self.db_conn, 'multi_feed_test_%d' % i, storage_paradigm=TIME_BASED)
+            feed.insert_stix_object_in_arango([IPv4Address(value='10.10.10.%d' % i)])
+            feeds.append(feed)
+        pattern = "[ipv4-addr:value LIKE '10.10.10.%']"
+        # a feed without collection does not fail the other ones
+        empty_feed = Feed(self.db_conn, 'multi_feed_empty', storage_paradigm=TIME_BASED)
+        results = self.request.request_feeds(feeds + [empty_feed], pattern, max_depth=0)
+        expected = []
+        for feed in feeds:
+            expected += self.request.request_one_feed(feed, pattern, max_depth=0)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results, expected)
+        self.assertEqual(
+            [r['x_feed'] for r in results],
+            ['multi_feed_test_%d' % i for i in range(3)]
+        )
+        print('OK')
+
+    def test_request_deadline(self):
+        print('\n\n> Request deadline')
+        feed = Feed(self.db_conn, 'deadline_test', storage_paradigm=TIME_BASED)
+        feed.insert_stix_object_in_arango([IPv4Address(value='10.10.11.1')])
+        request = Request(self.db_conn, datetime.now(), timeout=0)
+        results = request.request_feeds([feed], "[ipv4-addr:value = '10.10.11.1']")
+        self.assertEqual(results, [])
+        self.assertEqual(request.timed_out_feeds, ['deadline_test'])
+        request.timeout = 60
+        results = request.request_feeds([feed], "[ipv4-addr:value = '10.10.11.1']")
+        self.assertEqual(len(results), 1)
+        self.assertEqual(request.timed_out_feeds, [])
+        print('OK')
+
+    def test_batch_graph_traversal(self):
+        print('\n\n> Batched graph traversal')
+        feed = Feed(self.db_conn, 'traversal_test', storage_paradigm=TIME_BASED)
+        ipv4 = IPv4Address(value='10.10.12.1')
+        ipv6 = IPv6Address(value='2001:db8::1')
+        identity = Identity(name='Traversal', identity_class='group')
+        relations = [
+            Relationship(source_ref=identity.id, target_ref=ipv4.id, relationship_type='attributed-to'),
+            Relationship(source_ref=identity.id, target_ref=ipv6.id, relationship_type='attributed-to')
+        ]
+        feed.insert_stix_object_in_arango([ipv4, ipv6, identity] + relations)
+        col_name = feed.storage_paradigm.get_collection_name(feed)
+        ids = [d['_id'] for d in self.db_conn.AQLQuery(
+            'FOR d IN @@col FILTER d.type IN ["ipv4-addr", "ipv6-addr"] RETURN d',
+            rawResults=True,
+            bindVars={'@col': col_name}
+        )]
+        self.assertEqual(len(ids), 2)
+        neighbours = self.request._batch_graph_traversal(ids, feed)
+        for id in ids:
+            self.assertIn(identity.id, [v['id'] for v in neighbours[id]])
+            self.assertEqual(
+                sorted(v['_id'] for v in neighbours[id]),
+                sorted(v['_id'] for v in self.request._graph_traversal(id, feed))
+            )
+        print('OK')
+
     # def remove_tests():
     #     colname = 'meta_history'
     #     try:
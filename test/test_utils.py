@@ -1,13 +1,17 @@
 import unittest
 
 import sys
+import os
+import tempfile
+import time
+import json
 from datetime import datetime
 
 sys.path.insert(0, '/app')
 
-from stix2 import DomainName, Identity, Relationship, IPv4Address, ThreatActor
+from stix2 import DomainName, Identity, Relationship, IPv4Address, ThreatActor, Bundle, Indicator, Malware
 
-from stix2arango.utils import update_id_for_sdo, update_uid_for_obj_list, merge_obj_list
+from stix2arango.utils import update_id_for_sdo, update_uid_for_obj_list, fast_update_uid_for_obj_list, merge_obj_list, RateLimiter, iter_stix_file, object_digest, stix_id_to_key, deterministic_id
 
 class TestUpdateIDForSDO(unittest.TestCase):
     def setUp(self):      
@@ -73,6 +77,59 @@ class TestUpdateIDForManySDO(unittest.TestCase):
         self.assertEqual(sro0.target_ref, sco1.id)
 
 
+class TestFastUpdateUID(unittest.TestCase):
+    def setUp(self):
+        self.sco0 = IPv4Address(value='8.8.8.8')
+        self.sco1 = DomainName(value='google.fr', resolves_to_refs=[self.sco0])
+        self.sro0 = Relationship(source_ref=self.sco0, target_ref=self.sco1, relationship_type='test')
+
+    def test_fast_update(self):
+        sco0, sco1, sro0 = fast_update_uid_for_obj_list([self.sco0, self.sco1, self.sro0])
+        self.assertNotEqual(self.sco0.id, sco0['id'])
+        self.assertTrue(sco0['id'].startswith('ipv4-addr--'))
+        self.assertEqual(sco1['resolves_to_refs'][0], sco0['id'])
+        self.assertEqual(sro0['id'], self.sro0.id)
+        self.assertEqual(sro0['source_ref'], sco0['id'])
+        self.assertEqual(sro0['target_ref'], sco1['id'])
+
+    def test_reproducible(self):
+        other = IPv4Address(value='8.8.8.8', custom_properties={'x_source': 'feed'})
+        first = fast_update_uid_for_obj_list([self.sco0])
+        second = fast_update_uid_for_obj_list([other])
+        self.assertEqual(first[0]['id'], second[0]['id'])
+
+    def test_stix_and_json(self):
+        indicator = Indicator(pattern="[ipv4-addr:value = '8.8.8.8']", pattern_type='stix', valid_from='2020-01-01T00:00:00Z')
+        malware = Malware(name='mushroom', is_family=False, kill_chain_phases=[{'kill_chain_name': 'kc', 'phase_name': 'p'}])
+        for obj in [indicator, malware, self.sco0]:
+            parsed = json.loads(obj.serialize())
+            self.assertEqual(deterministic_id(obj), deterministic_id(parsed))
+            self.assertEqual(deterministic_id(dict(obj)), deterministic_id(parsed))
+
+    def test_processes(self):
+        l_obj = [self.sco0, self.sco1, self.sro0]
+        self.assertEqual(
+            fast_update_uid_for_obj_list(l_obj),
+            fast_update_uid_for_obj_list(l_obj, processes=2)
+        )
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_rate(self):
+        limiter = RateLimiter(50)
+        start = time.monotonic()
+        for _ in range(6):
+            limiter.wait()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_unlimited(self):
+        limiter = RateLimiter()
+        start = time.monotonic()
+        for _ in range(100):
+            limiter.wait()
+        self.assertLess(time.monotonic() - start, 0.05)
+
+
 class TestMergeObj(unittest.TestCase):
     def setUp(self):
         sco0 = DomainName(value='bing.com')
@@ -106,4 +163,67 @@ class TestMergeObj(unittest.TestCase):
         
     def test_merge(self):
         merge_obj_list(self.list)
-        self.assertEqual( len(self.list), 3)
\ No newline at end of file
+        self.assertEqual( len(self.list), 3)
+
+
+class TestIterStixFile(unittest.TestCase):
+    def setUp(self):
+        self.objects = [DomainName(value='domain%d.com' % i) for i in range(50)]
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def check(self, path):
+        ids = [obj['id'] for obj in iter_stix_file(path, chunk_size=64)]
+        self.assertEqual(ids, [obj.id for obj in self.objects])
+
+    def test_bundle(self):
+        bundle = Bundle(self.objects)
+        self.check(self.write('bundle.json', bundle.serialize(pretty=True)))
+        self.check(self.write('bundle_one_line.json', bundle.serialize()))
+
+    def test_sorted_bundle(self):
+        content = json.dumps(json.loads(Bundle(self.objects).serialize()), sort_keys=True)
+        self.assertLess(content.index('"objects"'), content.index('"type"'))
+        self.check(self.write('bundle_sorted.json', content))
+
+    def test_jsonl(self):
+        content = '\n'.join([obj.serialize() for obj in self.objects])
+        self.check(self.write('objects.jsonl', content))
+
+    def test_corrupt(self):
+        content = '\n'.join(['{"type": "domain-name",'] + [obj.serialize() for obj in self.objects])
+        with self.assertRaises(ValueError):
+            list(iter_stix_file(self.write('corrupt.jsonl', content), chunk_size=64))
+
+
+class TestObjectDigest(unittest.TestCase):
+    def test_digest(self):
+        obj1 = {'type': 'ipv4-addr', 'value': '8.8.8.8', 'x_ip': {'a': 1, 'b': 2}}
+        obj2 = {'x_ip': {'b': 2, 'a': 1}, 'value': '8.8.8.8', 'type': 'ipv4-addr'}
+        obj3 = {'type': 'ipv4-addr', 'value': '8.8.4.4'}
+        self.assertEqual(object_digest(obj1), object_digest(obj2))
+        self.assertNotEqual(object_digest(obj1), object_digest(obj3))
+        self.assertEqual(len(object_digest(obj1)), 16)
+
+    def test_stix_and_json(self):
+        indicator = Indicator(pattern="[ipv4-addr:value = '8.8.8.8']", pattern_type='stix', valid_from='2020-01-01T00:00:00Z')
+        malware = Malware(name='mushroom', is_family=False, kill_chain_phases=[{'kill_chain_name': 'kc', 'phase_name': 'p'}])
+        for obj in [indicator, malware, IPv4Address(value='8.8.8.8')]:
+            parsed = json.loads(obj.serialize())
+            self.assertEqual(object_digest(obj), object_digest(parsed))
+            self.assertEqual(object_digest(dict(obj)), object_digest(parsed))
+
+
+class TestStixIdToKey(unittest.TestCase):
+    def test_key(self):
+        sco0 = IPv4Address(value='8.8.8.8')
+        sco1 = IPv4Address(value='8.8.4.4')
+        key = stix_id_to_key(sco0.id)
+        self.assertEqual(key, stix_id_to_key(sco0.id))
+        self.assertNotEqual(key, stix_id_to_key(sco1.id))
+        self.assertLess(int(key), 2 ** 63)